@@ -0,0 +1,204 @@
+"""Helpers for placing build outputs (images and other static assets)."""
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # optional; without it only .gz siblings are written
+    brotli = None
+
+# hex digits of the content hash kept in published asset names
+HASH_LENGTH = 16
+# ioctl request that clones a file's extents (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def file_digest(path) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hashed_name(digest: str, suffix: str) -> str:
+    """Published name for a content-hashed asset, e.g. '3f2a...9c.webp'."""
+    return digest[:HASH_LENGTH] + suffix
+
+
+def write_hashed_json(folder: Path, data) -> str:
+    """Write data as compact JSON to folder/<content hash>.json and return the file name.
+
+    An existing file with the same name already has the same content, so it
+    is left untouched (keeping its mtime for precompress).
+    """
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    name = hashed_name(hashlib.sha256(raw).hexdigest(), '.json')
+    path = folder / name
+    if not path.exists():
+        folder.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix('.tmp')
+        tmp_file.write_bytes(raw)
+        os.replace(tmp_file, path)
+    return name
+
+
+def remove_stale(folder: Path, keep):
+    """Delete files in folder that are not in `keep` (precompressed siblings of kept files stay)."""
+    if not folder.exists():
+        return
+    for path in folder.iterdir():
+        name = path.name[:-3] if path.suffix in ('.gz', '.br') else path.name
+        if path.is_file() and name not in keep:
+            path.unlink()
+
+
+def write_json_asset(path: Path, data):
+    """Write a JSON build output (e.g. asset-manifest.json) with stable formatting."""
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True), encoding='utf-8')
+
+
+def _reflink(src: Path, dst: Path):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place_file(src: Path, dst: Path):
+    """Put src at dst, preferring a reflink, then a hardlink, then a real copy."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        _reflink(src, dst)
+        shutil.copystat(src, dst)
+        return
+    except OSError:
+        if dst.exists():
+            dst.unlink()
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+
+
+def load_manifest(manifest_file: Path):
+    """Load a JSON manifest from .cache/, or {} if it is missing or corrupt."""
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_file: Path, manifest):
+    """Write a JSON manifest atomically."""
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+def sync_files(files, dest_dir: Path, manifest_file: Path, workers=None):
+    """Make dest_dir contain exactly `files` ({relative path: source path}).
+
+    Sources whose size and mtime match the manifest from the previous run
+    (and whose destination still exists) are left alone; new or changed
+    files are placed on a thread pool and files no longer wanted are
+    removed. Returns a (placed, unchanged, removed) tuple of counts.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    old_manifest = load_manifest(manifest_file)
+    manifest = {}
+    todo = []
+
+    for rel, src in files.items():
+        st = os.stat(src)
+        key = [st.st_size, st.st_mtime_ns]
+        manifest[rel] = key
+        dst = dest_dir / rel
+        if old_manifest.get(rel) == key:
+            try:
+                if dst.stat().st_size == st.st_size:
+                    continue
+            except FileNotFoundError:
+                pass
+        todo.append((Path(src), dst))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda job: place_file(*job), todo))
+
+    # remove orphans (files from earlier builds that are no longer wanted)
+    removed = 0
+    for root, dirs, names in os.walk(dest_dir, topdown=False):
+        root = Path(root)
+        for name in names:
+            path = root / name
+            if path.relative_to(dest_dir).as_posix() not in manifest:
+                path.unlink()
+                removed += 1
+        if root != dest_dir and not any(root.iterdir()):
+            root.rmdir()
+
+    if manifest != old_manifest:
+        save_manifest(manifest_file, manifest)
+    return len(todo), len(files) - len(todo), removed
+
+
+# text outputs that get .gz/.br siblings for nginx gzip_static/brotli_static
+PRECOMPRESS_SUFFIXES = {'.html', '.json', '.js', '.css', '.svg', '.txt'}
+
+
+def precompress(build_folder: Path, skip=('images', 'asset-manifest.json')):
+    """Write maximum-compression .gz and .br siblings for the text files in build_folder.
+
+    Top-level names in `skip` (image folders, build-only metadata) are ignored.
+
+    A sibling gets the source's mtime, so files that did not change since
+    the last build are not recompressed; siblings whose source is gone are
+    removed. Returns the number of files (re)compressed.
+    """
+    compressed = 0
+    for root, dirs, names in os.walk(build_folder):
+        root = Path(root)
+        if root == build_folder:
+            dirs[:] = [d for d in dirs if d not in skip]
+            names = [n for n in names if n not in skip]
+        for name in names:
+            path = root / name
+            if path.suffix in ('.gz', '.br'):
+                if not path.with_suffix('').exists():
+                    path.unlink()
+                continue
+            if path.suffix not in PRECOMPRESS_SUFFIXES:
+                continue
+            st = path.stat()
+            targets = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                targets.append(('.br', lambda data: brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)))
+            else:
+                # never leave a stale .br from an earlier build next to a newer source
+                path.with_name(name + '.br').unlink(missing_ok=True)
+            data = None
+            for suffix, compress in targets:
+                out = path.with_name(name + suffix)
+                try:
+                    if out.stat().st_mtime_ns == st.st_mtime_ns:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if data is None:
+                    data = path.read_bytes()
+                    compressed += 1
+                out.write_bytes(compress(data))
+                os.utime(out, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return compressed
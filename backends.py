@@ -0,0 +1,168 @@
+"""Model backends for resolve.py.
+
+A backend has a `model_name` (part of the response cache key) and
+`generate_content(contents)`, which takes a list of prompt strings and PIL
+images and returns a response with a `.text` attribute, like the Gemini SDK.
+Errors worth retrying are raised as TransientModelError (or ConnectionError /
+TimeoutError). Offline backends set `cacheable = False`, so their answers do
+not end up in the response cache.
+"""
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from assets import file_digest
+from corpus import image_files, scan_questions_dir
+from screenshots import preprocess_screenshot
+
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+
+
+class TransientModelError(Exception):
+    """A model call failed in a way that is worth retrying (rate limit, timeout, server error)."""
+
+
+class TextResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class ModelBackend:
+    """Base class for the backends; see the module docstring."""
+
+    model_name = None
+    cacheable = True
+
+    def generate_content(self, contents):
+        raise NotImplementedError
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini through google-generativeai, imported and configured on first use."""
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    import google.generativeai as genai
+                except ImportError:
+                    raise RuntimeError("google-generativeai is not installed (pip install google-generativeai)")
+                # Configure the API key (set your API key as environment variable)
+                genai.configure(api_key=self.api_key or os.environ.get("GOOGLE_API_KEY"))
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def generate_content(self, contents):
+        model = self._get_model()
+        from google.api_core import exceptions as google_exceptions
+        try:
+            return model.generate_content(contents)
+        except (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+                google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                google_exceptions.DeadlineExceeded) as e:
+            raise TransientModelError(str(e)) from e
+
+
+class SyntheticLatency:
+    """Sleeps like a remote model would and fails at a given rate, for offline benchmarks."""
+
+    def __init__(self, latency=1.0, jitter=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def wait(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.failure_rate:
+            raise TransientModelError("simulated transient failure")
+
+
+def batch_ids(contents):
+    """Image ids of a batched prompt ("IMAGE <id>" markers, see resolve.BATCH_PROMPT)."""
+    return [c.split(maxsplit=1)[1] for c in contents if isinstance(c, str) and c.startswith("IMAGE ")]
+
+
+def strip_fences(text):
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+class StubBackend(ModelBackend):
+    """Answers every screenshot with the same valid quiz JSON after a synthetic delay."""
+
+    model_name = 'stub'
+    cacheable = False
+
+    def __init__(self, latency=1.0, jitter=0.0, failure_rate=0.0):
+        self.delay = SyntheticLatency(latency, jitter, failure_rate)
+
+    def generate_content(self, contents):
+        self.delay.wait()
+        answers = [{"text": f"Odpověď {i}: $x^{i}$", "correct": i % 2 == 1} for i in range(1, 5)]
+        quiz = {"questions": [{"question": "Stub otázka $\\int_0^1 x\\,dx$", "category": "Stub", "answers": answers}]}
+        ids = batch_ids(contents)
+        if ids:
+            quiz = {"images": {image_id: quiz for image_id in ids}}
+        return TextResponse("```json\n" + json.dumps(quiz, ensure_ascii=False, indent=2) + "\n```")
+
+
+class ReplayBackend(ModelBackend):
+    """Serves the raw_response.txt recorded for each screenshot under questions/.
+
+    Uploads are matched to the recordings by the content hash of the image
+    file, so `preprocess` must be the options resolve.py runs with: the
+    recorded screenshots are pre-processed the same way (cached, see
+    screenshots.py) before hashing. Batched prompts get the recordings
+    combined per image id; follow-up prompts get an empty answer. Responses
+    arrive after a synthetic delay.
+    """
+
+    model_name = 'replay'
+    cacheable = False
+
+    def __init__(self, questions_dir: Path, preprocess=None, latency=1.0, jitter=0.0, failure_rate=0.0):
+        self.delay = SyntheticLatency(latency, jitter, failure_rate)
+        folders = [f for f in scan_questions_dir(questions_dir) if (f.path / "raw_response.txt").exists()]
+        self.recordings = {}
+        for key, path in image_files(folders).items():
+            upload = preprocess_screenshot(path, preprocess)[0] if preprocess else path
+            self.recordings[file_digest(upload)] = path.parent / "raw_response.txt"
+        print(f"Replaying {len(self.recordings)} recorded responses from {questions_dir}")
+
+    def recorded(self, image):
+        recording = self.recordings.get(file_digest(image.filename))
+        if recording is None:
+            raise LookupError(f"no recorded response for {image.filename}")
+        return recording.read_text(encoding='utf-8')
+
+    def generate_content(self, contents):
+        self.delay.wait()
+        images = [c for c in contents if isinstance(c, Image.Image)]
+        ids = batch_ids(contents)
+        if ids:
+            parts = [f'"{image_id}": {strip_fences(self.recorded(im))}' for image_id, im in zip(ids, images)]
+            return TextResponse('{"images": {' + ", ".join(parts) + '}}')
+        # the main prompt (resolve.PROMPT), as opposed to a follow-up question
+        if len(images) == 1 and contents[0].lstrip().startswith("Analyze this math quiz image"):
+            return TextResponse(self.recorded(images[0]))
+        return TextResponse("{}")
+
+
+BACKENDS = {'gemini': GeminiBackend, 'replay': ReplayBackend, 'stub': StubBackend}
@@ -0,0 +1,133 @@
+"""Compact, dictionary-encoded wire format for question shards.
+
+A shard normally is a list of question records. The compact form stores
+the same records column by column instead:
+
+    {"f": 2,                   format version
+     "t": [...],               interned strings: repeated TeX fragments and MathML elements
+     "c": "...",               category of every question (a shard holds one category)
+     "q": [...],               question text
+     "a": [[...], ...],        answer texts per question
+     "m": [...],               correct answers as a bitmask (bit i = answer i)
+     "id": [...],              quiz_id
+     "s": [...],               source_folder, or 0 when it equals quiz_id
+     "i": [...],               image file name under images/, or 0
+     "v": [...],               image_variants, or 0
+     "x": [...],               indices of questions with math_fallback
+     "sf": [...]}              source_folders of collapsed duplicates, or 0 (only when any question has them)
+
+A text is a plain string, or a list whose numbers refer to interned strings
+in "t" and whose strings are literal pieces. Repeated TeX fragments are
+interned whole and MathML element by element (<mi>x</mi>, <mrow>, ...),
+since the same few elements make up most of it. DECODER_JS turns it back into
+the record list the page works with.
+"""
+import re
+from collections import Counter
+
+COMPACT_FORMAT_VERSION = 2
+# math fragments: pre-rendered MathML, or TeX left for MathJax
+FRAGMENT_PATTERN = re.compile(r'<math[ >].*?</math>|\$\$.+?\$\$|\\\[.+?\\\]|\$.+?\$|\\\(.+?\\\)', re.DOTALL)
+# markup inside a MathML fragment: a leaf element such as <mi>x</mi>, or a single tag such as <mrow>
+MATHML_TOKEN_PATTERN = re.compile(r'<(m[a-z]+)(?: [^>]*)?>[^<]*</\1>|<[^>]+>')
+# shorter fragments and MathML elements cost more as a reference than they save
+MIN_FRAGMENT_LENGTH = 12
+MIN_TOKEN_LENGTH = 5
+
+
+def _texts(question):
+    yield question.get('question', '')
+    for ans in question.get('answers', []):
+        yield ans.get('text', '')
+
+
+def _pieces(text, fragments, tokens):
+    """Split text into (string, interned) pieces: literal text and the fragments/MathML tokens to intern."""
+    pos = 0
+    for m in FRAGMENT_PATTERN.finditer(text):
+        fragment = m.group(0)
+        if fragment.startswith('<math'):
+            for t in MATHML_TOKEN_PATTERN.finditer(fragment):
+                if t.group(0) in tokens:
+                    yield text[pos:m.start() + t.start()], False
+                    yield t.group(0), True
+                    pos = m.start() + t.end()
+        elif fragment in fragments:
+            yield text[pos:m.start()], False
+            yield fragment, True
+            pos = m.end()
+    yield text[pos:], False
+
+
+def encode_shard(questions):
+    """Encode a list of question records of one category in the compact format."""
+    all_texts = [text for q in questions for text in _texts(q) if text]
+    counts = Counter(m.group(0) for text in all_texts for m in FRAGMENT_PATTERN.finditer(text))
+    # TeX is interned whole, MathML element by element (that saves more than whole MathML fragments)
+    fragments = {f for f, n in counts.items()
+                 if n >= 2 and len(f) >= MIN_FRAGMENT_LENGTH and not f.startswith('<math')}
+    token_counts = Counter(
+        t.group(0) for f, n in counts.items() if f.startswith('<math')
+        for t in MATHML_TOKEN_PATTERN.finditer(f) for _ in range(n)
+    )
+    tokens = {t for t, n in token_counts.items() if n >= 2 and len(t) >= MIN_TOKEN_LENGTH}
+    # the strings that save the most get the shortest references
+    savings = Counter({f: counts[f] * len(f) for f in fragments})
+    savings.update({t: token_counts[t] * len(t) for t in tokens})
+    table = [s for s, _ in savings.most_common()]
+    index = {s: n for n, s in enumerate(table)}
+
+    def encode_text(text):
+        if not text:
+            return text
+        parts = []
+        for piece, interned in _pieces(text, fragments, tokens):
+            if interned:
+                parts.append(index[piece])
+            elif piece and parts and isinstance(parts[-1], str):
+                # literal text between interned pieces stays one string
+                parts[-1] += piece
+            elif piece:
+                parts.append(piece)
+        return parts if len(parts) > 1 or parts and isinstance(parts[0], int) else text
+
+    category = questions[0].get('category', 'Matematika') if questions else 'Matematika'
+    shard = {'f': COMPACT_FORMAT_VERSION, 't': table, 'c': category, 'q': [], 'a': [], 'm': [],
+             'id': [], 's': [], 'i': [], 'v': [], 'x': []}
+    for n, q in enumerate(questions):
+        shard['q'].append(encode_text(q.get('question', '')))
+        answers = q.get('answers', [])
+        shard['a'].append([encode_text(ans.get('text', '')) for ans in answers])
+        shard['m'].append(sum(1 << i for i, ans in enumerate(answers) if ans.get('correct')))
+        shard['id'].append(q['quiz_id'])
+        shard['s'].append(0 if q['source_folder'] == q['quiz_id'] else q['source_folder'])
+        image = q.get('image')
+        shard['i'].append(image.removeprefix('images/') if image else 0)
+        shard['v'].append(q.get('image_variants') or 0)
+        if q.get('math_fallback'):
+            shard['x'].append(n)
+    if any(q.get('source_folders') for q in questions):
+        shard['sf'] = [q.get('source_folders') or 0 for q in questions]
+    return shard
+
+
+# Inverse of encode_shard for the generated page; plain record lists pass through.
+DECODER_JS = """
+        function decodeShard(data) {
+            if (Array.isArray(data)) return data;
+            const t = data.t;
+            const text = s => Array.isArray(s) ? s.map(p => typeof p === 'number' ? t[p] : p).join('') : s;
+            const fallback = new Set(data.x);
+            return data.q.map((q, n) => ({
+                question: text(q),
+                category: data.c,
+                answers: data.a[n].map((a, i) => ({ text: text(a), correct: (data.m[n] >> i & 1) === 1 })),
+                image: data.i[n] ? 'images/' + data.i[n] : null,
+                image_variants: data.v[n] || null,
+                source_folder: data.s[n] || data.id[n],
+                quiz_id: data.id[n],
+                source_folders: data.sf && data.sf[n] || undefined,
+                math_fallback: fallback.has(n)
+            }));
+        }
+"""
@@ -0,0 +1,297 @@
+"""Shared question corpus loader for generate.py and generate_next_public.py.
+
+questions/ is compiled into an indexed SQLite store (.cache/questions.db)
+that both builders read; run this module to update it and to query it:
+
+    python corpus.py "SELECT DISTINCT quiz_id FROM answers JOIN questions ON id = question_id WHERE text LIKE '%\\sum%'"
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple
+
+from assets import file_digest
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
+QUESTION_DB_FILE = Path("./.cache") / "questions.db"
+# bump whenever the schema or the per-question processing changes, so the store gets rebuilt
+QUESTION_DB_VERSION = 1
+
+MATH_PATTERN = re.compile(r'(\$\$.*?\$\$)|(\$.*?\$)|\\\((?:.|\n)*?\\\)', re.DOTALL)
+
+
+class QuestionFolder(NamedTuple):
+    """One questions/<id>/ folder, indexed by a single directory listing."""
+    name: str
+    path: Path
+    json_size: int
+    json_mtime_ns: int
+    images: list
+
+
+def _displaystyle_repl(m):
+    s = m.group(0)
+    # leave display math ($$...$$) unchanged
+    if s.startswith('$$'):
+        return s
+    # $...$ inline
+    if s.startswith('$') and s.endswith('$'):
+        inner = s[1:-1]
+        if '\\int' in inner and '\\displaystyle' not in inner:
+            # avoid f-string with backslash; use concatenation
+            return '$' + '\\displaystyle ' + inner + '$'
+        return s
+    # \( ... \) inline
+    if s.startswith('\\(') and s.endswith('\\)'):
+        inner = s[2:-2]
+        if '\\int' in inner and '\\displaystyle' not in inner:
+            # avoid f-string with backslash; use concatenation
+            return '\\(' + '\\displaystyle ' + inner + '\\)'
+        return s
+    return s
+
+
+def process_math_inline(text: str) -> str:
+    """Add \\displaystyle in inline math that contains \\int (skip $$...$$)."""
+    if not text:
+        return text
+    return MATH_PATTERN.sub(_displaystyle_repl, text)
+
+
+def scan_questions_dir(src_dir: Path):
+    """Walk questions/ once and index each folder's quiz_data.json and images."""
+    folders = []
+    if not src_dir.exists():
+        return folders
+    with os.scandir(src_dir) as it:
+        dirs = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+    for d in dirs:
+        json_stat = None
+        images = []
+        with os.scandir(d.path) as it:
+            for e in it:
+                if e.name == "quiz_data.json":
+                    json_stat = e.stat()
+                elif os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS:
+                    images.append(e.name)
+        if json_stat is None:
+            continue
+        folders.append(QuestionFolder(d.name, Path(d.path), json_stat.st_size,
+                                      json_stat.st_mtime_ns, sorted(images)))
+    return folders
+
+
+def process_folder(folder: QuestionFolder, data):
+    """Turn one parsed quiz_data.json into normalized question records."""
+    image_name = folder.images[0] if folder.images else None
+    quiz_id = data.get('id')  # <- read quiz id from json (if present)
+    questions = []
+    for question in data.get('questions', []):
+        # process math in question and answers to prefer displaystyle for integrals
+        question['question'] = process_math_inline(question.get('question', ''))
+        for ans in question.get('answers', []):
+            ans['text'] = process_math_inline(ans.get('text', ''))
+
+        question['image'] = f"images/{folder.name}/{image_name}" if image_name else None
+        question['source_folder'] = folder.name
+        # attach quiz/folder id to each question (string)
+        question['quiz_id'] = str(quiz_id) if quiz_id is not None else folder.name
+        questions.append(question)
+    return questions
+
+
+SCHEMA = """
+CREATE TABLE folders (
+    name TEXT PRIMARY KEY,
+    quiz_id TEXT NOT NULL,
+    hash TEXT NOT NULL,             -- sha256 of quiz_data.json
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE questions (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL REFERENCES folders(name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    quiz_id TEXT NOT NULL,
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    question TEXT NOT NULL,
+    image TEXT,
+    record TEXT NOT NULL            -- the normalized record as JSON, as the builders use it
+);
+CREATE TABLE answers (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (question_id, position)
+);
+CREATE TABLE images (
+    folder TEXT NOT NULL REFERENCES folders(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,           -- assets.file_digest of the screenshot
+    PRIMARY KEY (folder, name)
+);
+CREATE INDEX questions_folder ON questions(folder, position);
+CREATE INDEX questions_quiz_id ON questions(quiz_id);
+CREATE INDEX questions_category ON questions(category_id);
+"""
+
+
+def open_question_db(db_file: Path = QUESTION_DB_FILE):
+    """Open the question store, (re)creating it when its schema version is outdated."""
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != QUESTION_DB_VERSION:
+        conn.close()
+        db_file.unlink()
+        conn = sqlite3.connect(db_file)
+        conn.execute("PRAGMA foreign_keys = ON")
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {QUESTION_DB_VERSION}")
+    return conn
+
+
+def _store_folder(conn, folder: QuestionFolder, digest, questions, categories):
+    conn.execute("DELETE FROM questions WHERE folder = ?", (folder.name,))
+    conn.execute("INSERT INTO folders VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                 "quiz_id = excluded.quiz_id, hash = excluded.hash, size = excluded.size, mtime_ns = excluded.mtime_ns",
+                 (folder.name, questions[0]['quiz_id'] if questions else folder.name, digest,
+                  folder.json_size, folder.json_mtime_ns))
+    for position, q in enumerate(questions):
+        category = q.get('category', 'Matematika')
+        if category not in categories:
+            conn.execute("INSERT INTO categories (name) VALUES (?)", (category,))
+            categories[category] = conn.execute("SELECT id FROM categories WHERE name = ?", (category,)).fetchone()[0]
+        question_id = conn.execute(
+            "INSERT INTO questions (folder, position, quiz_id, category_id, question, image, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (folder.name, position, q['quiz_id'], categories[category], q.get('question', ''), q.get('image'),
+             json.dumps(q, ensure_ascii=False)),
+        ).lastrowid
+        conn.executemany("INSERT INTO answers VALUES (?, ?, ?, ?)", [
+            (question_id, i, ans.get('text', ''), bool(ans.get('correct'))) for i, ans in enumerate(q.get('answers', []))
+        ])
+
+
+def _sync_images(conn, folder: QuestionFolder):
+    """Bring the folder's image rows up to date, hashing only new or modified screenshots."""
+    known = {name: (size, mtime_ns) for name, size, mtime_ns in
+             conn.execute("SELECT name, size, mtime_ns FROM images WHERE folder = ?", (folder.name,))}
+    for name in set(known) - set(folder.images):
+        conn.execute("DELETE FROM images WHERE folder = ? AND name = ?", (folder.name, name))
+    for name in folder.images:
+        st = os.stat(folder.path / name)
+        if known.get(name) != (st.st_size, st.st_mtime_ns):
+            conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)",
+                         (folder.name, name, st.st_size, st.st_mtime_ns, file_digest(folder.path / name)))
+
+
+def sync_question_db(conn, folders):
+    """Bring the question store up to date with the folders from scan_questions_dir.
+
+    Folders are matched by the size and mtime of their quiz_data.json, then
+    by its content hash, so only changed folders get re-parsed; folders
+    that disappeared are dropped. Returns the number of re-parsed folders.
+    """
+    stored = {name: (digest, size, mtime_ns) for name, digest, size, mtime_ns in
+              conn.execute("SELECT name, hash, size, mtime_ns FROM folders")}
+    stored_images = {}
+    for folder_name, name in conn.execute("SELECT folder, name FROM images ORDER BY folder, name"):
+        stored_images.setdefault(folder_name, []).append(name)
+    categories = dict(conn.execute("SELECT name, id FROM categories"))
+    rebuilt = 0
+    with conn:
+        for name in set(stored) - {folder.name for folder in folders}:
+            conn.execute("DELETE FROM folders WHERE name = ?", (name,))
+        for folder in folders:
+            entry = stored.get(folder.name)
+            images_unchanged = stored_images.get(folder.name, []) == folder.images
+            if not (entry and images_unchanged and entry[1:] == (folder.json_size, folder.json_mtime_ns)):
+                raw = (folder.path / "quiz_data.json").read_bytes()
+                digest = hashlib.sha256(raw).hexdigest()
+                if entry and images_unchanged and entry[0] == digest:
+                    conn.execute("UPDATE folders SET size = ?, mtime_ns = ? WHERE name = ?",
+                                 (folder.json_size, folder.json_mtime_ns, folder.name))
+                else:
+                    questions = process_folder(folder, json.loads(raw.decode('utf-8')))
+                    _store_folder(conn, folder, digest, questions, categories)
+                    rebuilt += 1
+            _sync_images(conn, folder)
+        conn.execute("DELETE FROM categories WHERE id NOT IN (SELECT category_id FROM questions)")
+    return rebuilt
+
+
+def collect_all_questions(folders, db_file: Path = QUESTION_DB_FILE):
+    """Collect normalized question records for the folders from scan_questions_dir.
+
+    The records are read from the SQLite question store in db_file, which
+    is first synced with the folders (see sync_question_db).
+    """
+    conn = open_question_db(db_file)
+    try:
+        rebuilt = sync_question_db(conn, folders)
+        all_questions = [json.loads(record) for (record,) in
+                         conn.execute("SELECT record FROM questions ORDER BY folder, position")]
+    finally:
+        conn.close()
+    print(f"Rebuilt {rebuilt} of {len(folders)} question folders (others cached)")
+    return all_questions
+
+
+def image_digests(db_file: Path = QUESTION_DB_FILE):
+    """Map each question image to its content hash ({'<folder>/<name>': assets.file_digest}).
+
+    The hashes come from the question store's images table, so call this
+    after collect_all_questions has synced it with the same folders.
+    """
+    conn = open_question_db(db_file)
+    try:
+        return {f"{folder}/{name}": digest for folder, name, digest in
+                conn.execute("SELECT folder, name, digest FROM images")}
+    finally:
+        conn.close()
+
+
+def image_files(folders):
+    """Map each question image to its path under images/ ({'<folder>/<name>': source})."""
+    return {f"{folder.name}/{name}": folder.path / name for folder in folders for name in folder.images}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the question store from questions/ and optionally query it.")
+    parser.add_argument('sql', nargs='?', help="SQL query to run against the store (tables: folders, categories, "
+                                               "questions, answers, images)")
+    parser.add_argument('--questions-dir', type=Path, default=Path("./questions"))
+    parser.add_argument('--db', type=Path, default=QUESTION_DB_FILE)
+    args = parser.parse_args()
+
+    folders = scan_questions_dir(args.questions_dir)
+    conn = open_question_db(args.db)
+    try:
+        rebuilt = sync_question_db(conn, folders)
+        if args.sql is None:
+            counts = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('folders', 'questions', 'categories', 'images')]
+            print(f"{args.db}: {rebuilt} folders updated; {counts[0]} folders, {counts[1]} questions, "
+                  f"{counts[2]} categories, {counts[3]} images")
+            return
+        for row in conn.execute(args.sql):
+            print("\t".join("" if v is None else str(v) for v in row))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
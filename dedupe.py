@@ -0,0 +1,169 @@
+"""Near-duplicate questions across exam dumps: MinHash signatures with LSH banding.
+
+Each question is reduced to a set of token shingles of its text and of
+each answer (tokens from search.tokenize, so LaTeX spacing, diacritics
+and case do not matter, and answer order does not either). Questions are
+only compared when their MinHash signatures agree in at least one LSH
+band, so the work grows with the number of questions and candidate pairs
+rather than with all pairs; candidates are confirmed by the exact Jaccard
+similarity of their shingle sets.
+
+Run this module for an audit of the duplicate clusters; generate.py
+--collapse-duplicates replaces the members that have the same answers and
+answer key as their cluster's first question by that question, and keeps
+the others as separate questions.
+"""
+import argparse
+import hashlib
+import struct
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from corpus import collect_all_questions, scan_questions_dir
+from search import tokenize
+
+SHINGLE_SIZE = 3
+# 32 bands of 4 rows: pairs with Jaccard similarity 0.5 become candidates ~87% of the time, 0.7 ~99.99%
+LSH_BANDS = 32
+LSH_ROWS = 4
+DUPLICATE_THRESHOLD = 0.7
+# minimum SequenceMatcher ratio of matched answers' tokens for a duplicate to be collapsed
+ANSWER_MATCH_THRESHOLD = 0.98
+_PRIME = (1 << 61) - 1
+# fixed permutations, so signatures and clusters are the same on every build
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], 'big') % (_PRIME - 1) + 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], 'big') % _PRIME)
+    for i in range(LSH_BANDS * LSH_ROWS)
+]
+
+
+def shingles(question):
+    """Set of hashed token shingles of a question record's text and answers."""
+    result = set()
+    texts = [question.get('question', '')] + [ans.get('text', '') for ans in question.get('answers', [])]
+    for n, text in enumerate(texts):
+        tokens = list(tokenize(text))
+        # the question text and the answers are shingled separately, so answer order does not matter
+        prefix = 'q' if n == 0 else 'a'
+        for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1)):
+            shingle = prefix + ' '.join(tokens[i:i + SHINGLE_SIZE])
+            result.add(int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big'))
+    return result
+
+
+def minhash(shingle_set):
+    """MinHash signature of a shingle set: one minimum per permutation."""
+    if not shingle_set:
+        return (0,) * len(_PERMUTATIONS)
+    return tuple(min((a * x + b) % _PRIME for x in shingle_set) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def find_duplicate_clusters(questions, threshold=DUPLICATE_THRESHOLD):
+    """Group question records into near-duplicate clusters.
+
+    Returns a list of clusters, each a sorted list of indices into
+    `questions` with at least two members, ordered by the first member.
+    """
+    sets = [shingles(q) for q in questions]
+    buckets = {}
+    for n, shingle_set in enumerate(sets):
+        signature = minhash(shingle_set)
+        for band in range(LSH_BANDS):
+            key = (band, struct.pack(f'>{LSH_ROWS}Q', *signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]))
+            buckets.setdefault(key, []).append(n)
+
+    parent = list(range(len(questions)))
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    checked = set()
+    for members in buckets.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if (a, b) in checked:
+                    continue
+                checked.add((a, b))
+                if find(a) != find(b) and jaccard(sets[a], sets[b]) >= threshold:
+                    parent[max(find(a), find(b))] = min(find(a), find(b))
+
+    clusters = {}
+    for n in range(len(questions)):
+        clusters.setdefault(find(n), []).append(n)
+    return sorted((members for members in clusters.values() if len(members) > 1), key=lambda m: m[0])
+
+
+def answer_difference(a, b):
+    """Why duplicate b cannot be collapsed into a, or None if it can.
+
+    Each answer of b is matched to the answer of a whose token sequence is
+    the most similar (answer order and TeX spelling differ between dumps).
+    Returns 'answer texts differ' if a match is not nearly identical
+    (SequenceMatcher ratio below ANSWER_MATCH_THRESHOLD) and 'answer key
+    differs' if a matched answer is marked differently.
+    """
+    a_answers = [(list(tokenize(ans.get('text', ''))), bool(ans.get('correct'))) for ans in a.get('answers', [])]
+    b_answers = b.get('answers', [])
+    if len(a_answers) != len(b_answers):
+        return 'answer texts differ'
+    key_differs = False
+    for ans in b_answers:
+        tokens = list(tokenize(ans.get('text', '')))
+        ratio, correct = max((SequenceMatcher(None, candidate, tokens).ratio(), correct)
+                             for candidate, correct in a_answers)
+        if ratio < ANSWER_MATCH_THRESHOLD:
+            return 'answer texts differ'
+        key_differs = key_differs or correct != bool(ans.get('correct'))
+    return 'answer key differs' if key_differs else None
+
+
+def collapse_duplicates(questions, threshold=DUPLICATE_THRESHOLD):
+    """Keep one canonical record per near-duplicate cluster.
+
+    The canonical record is the cluster's first one (in corpus order) and
+    gets a `source_folders` list with the folders of the members it
+    replaces. Only members with the same answers and answer key (see
+    answer_difference) are replaced; the others are kept as separate
+    questions. Returns (questions, number of records removed).
+    """
+    removed = set()
+    for members in find_duplicate_clusters(questions, threshold):
+        canonical = questions[members[0]]
+        same = [n for n in members[1:] if answer_difference(canonical, questions[n]) is None]
+        if same:
+            canonical['source_folders'] = [canonical['source_folder']] + [questions[n]['source_folder'] for n in same]
+            removed.update(same)
+    return [q for n, q in enumerate(questions) if n not in removed], len(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report near-duplicate questions across question folders.")
+    parser.add_argument('--questions-dir', type=Path, default=Path("./questions"))
+    parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD,
+                        help="minimum Jaccard similarity of the shingle sets to count as a duplicate")
+    args = parser.parse_args()
+
+    questions = collect_all_questions(scan_questions_dir(args.questions_dir))
+    clusters = find_duplicate_clusters(questions, args.threshold)
+    for members in clusters:
+        first = questions[members[0]]
+        print(f"{len(members)} × {' '.join(first['question'].split())[:80]}")
+        for n in members:
+            q = questions[n]
+            difference = answer_difference(first, q) if n != members[0] else None
+            print(f"    {q['source_folder']}  {q.get('category', 'Matematika')}"
+                  + (f"  [{difference}, kept]" if difference else ""))
+    _, removed = collapse_duplicates(questions, args.threshold)
+    print(f"{len(clusters)} duplicate clusters; collapsing them would drop {removed} of {len(questions)} questions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Watch mode for generate.py: rebuild when questions/ changes, serve build/ and live-reload the page.
+
+Changes are picked up with watchdog (inotify on Linux) when it is
+installed, otherwise by polling the file sizes and mtimes. After each
+rebuild the open pages get a server-sent event and reload, reopening the
+question whose folder changed.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional; without it questions/ is polled
+    Observer = None
+
+POLL_INTERVAL = 0.2
+# changes arriving this soon after each other are rebuilt together (an editor save touches several files)
+DEBOUNCE = 0.05
+HEARTBEAT_INTERVAL = 15
+LIVE_RELOAD_PATH = "/__livereload"
+
+# Client for the dev build: reload on each event and reopen the edited question
+# (openSearchResult loads its category shard and shows it).
+LIVE_RELOAD_JS = """
+        (() => {
+            const reopen = JSON.parse(sessionStorage.getItem('liveReload') || 'null');
+            sessionStorage.removeItem('liveReload');
+            if (reopen && reopen.quiz_id !== null) {
+                window.addEventListener('DOMContentLoaded', () => openSearchResult(reopen.quiz_id, reopen.category));
+            }
+            new EventSource('""" + LIVE_RELOAD_PATH + """').onmessage = (e) => {
+                sessionStorage.setItem('liveReload', e.data);
+                location.reload();
+            };
+        })();
+"""
+
+
+class ReloadChannel:
+    """The latest reload event, handed to every connected page."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.serial = 0
+        self.event = None
+
+    def publish(self, event):
+        with self.condition:
+            self.serial += 1
+            self.event = event
+            self.condition.notify_all()
+
+    def wait(self, serial, timeout):
+        """Wait until there is an event newer than `serial`; returns (serial, event)."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.serial != serial, timeout)
+            return self.serial, self.event
+
+
+class DevRequestHandler(SimpleHTTPRequestHandler):
+    """Static files from build/ plus the server-sent event stream at LIVE_RELOAD_PATH."""
+    channel = None
+
+    def do_GET(self):
+        if self.path == LIVE_RELOAD_PATH:
+            self.stream_events()
+        else:
+            super().do_GET()
+
+    def end_headers(self):
+        # index.html changes on every rebuild; make the browser revalidate
+        self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        serial = self.channel.serial
+        try:
+            while True:
+                new_serial, event = self.channel.wait(serial, HEARTBEAT_INTERVAL)
+                if new_serial == serial:
+                    self.wfile.write(b": ping\n\n")
+                else:
+                    serial = new_serial
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _ignored(path):
+    # editor swap and backup files, and the .tmp files written before an atomic rename
+    name = os.path.basename(path)
+    return name.startswith('.') or name.endswith(('~', '.swp', '.tmp'))
+
+
+def _snapshot(folder: Path):
+    state = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            state[path] = (st.st_size, st.st_mtime_ns)
+    return state
+
+
+def poll_changes(folder: Path):
+    """Yield sets of changed file paths under folder, by comparing sizes and mtimes."""
+    state = _snapshot(folder)
+    while True:
+        time.sleep(POLL_INTERVAL)
+        new_state = _snapshot(folder)
+        changed = {path for path in state.keys() | new_state.keys()
+                   if state.get(path) != new_state.get(path) and not _ignored(path)}
+        state = new_state
+        if changed:
+            yield changed
+
+
+def notify_changes(folder: Path):
+    """Yield sets of changed file paths under folder, from watchdog events."""
+    events = queue.Queue()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            for path in (event.src_path, getattr(event, 'dest_path', '')):
+                if path and not _ignored(path):
+                    events.put(path)
+
+    observer = Observer()
+    observer.schedule(Handler(), str(folder), recursive=True)
+    observer.start()
+    try:
+        while True:
+            changed = {events.get()}
+            while True:
+                try:
+                    changed.add(events.get(timeout=DEBOUNCE))
+                except queue.Empty:
+                    break
+            yield changed
+    finally:
+        observer.stop()
+
+
+def reload_event(paths, questions_dir: Path, questions, shards):
+    """Reload event for changed paths: the quiz_id and category index of the first edited question."""
+    root = questions_dir.resolve()
+    folders = set()
+    for path in paths:
+        try:
+            folders.add(Path(path).resolve().relative_to(root).parts[0])
+        except (ValueError, IndexError):
+            continue
+    categories = [shard['name'] for shard in shards]
+    for q in questions:
+        if q['source_folder'] in folders or folders & set(q.get('source_folders', ())):
+            return {'quiz_id': q['quiz_id'], 'category': categories.index(q.get('category', 'Matematika'))}
+    return {'quiz_id': None}
+
+
+def serve_and_watch(build, questions_dir: Path, build_dir: Path, port=8000):
+    """Build, serve build_dir on localhost:port and rebuild on every change in questions_dir.
+
+    `build` is called without arguments and returns (questions, shards),
+    see generate.build_site.
+    """
+    questions, shards = build()
+    channel = ReloadChannel()
+    handler = partial(type('Handler', (DevRequestHandler,), {'channel': channel}), directory=str(build_dir))
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    method = "inotify/watchdog" if Observer else "polling"
+    print(f"\nServing {build_dir}/ on http://localhost:{port}/ and watching {questions_dir}/ ({method}); Ctrl+C to stop")
+    changes = notify_changes(questions_dir) if Observer else poll_changes(questions_dir)
+    try:
+        for paths in changes:
+            start = time.monotonic()
+            try:
+                questions, shards = build()
+            except Exception as e:
+                # typically a quiz_data.json saved in the middle of an edit; wait for the next save
+                print(f"✗ Rebuild failed: {type(e).__name__}: {e}")
+                continue
+            event = reload_event(paths, questions_dir, questions, shards)
+            channel.publish(event)
+            print(f"↻ Rebuilt in {(time.monotonic() - start) * 1000:.0f} ms, reloading "
+                  + (f"question {event['quiz_id']}" if event['quiz_id'] else "the page"))
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        server.shutdown()
@@ -1,77 +1,52 @@
+import argparse
 import json
 import shutil
 from pathlib import Path
-import random
-import re
 
-def collect_all_questions():
-    """Collect all questions from output folders."""
-    output_folder = Path("./questions")
-    all_questions = []
-    
-    # helper: add \displaystyle in inline math that contains \int (skip $$...$$)
-    def process_math_inline(text: str) -> str:
-        if not text:
-            return text
-        pattern = re.compile(r'(\$\$.*?\$\$)|(\$.*?\$)|\\\((?:.|\n)*?\\\)', re.DOTALL)
-        def repl(m):
-            s = m.group(0)
-            # leave display math ($$...$$) unchanged
-            if s.startswith('$$'):
-                return s
-            # $...$ inline
-            if s.startswith('$') and s.endswith('$'):
-                inner = s[1:-1]
-                if '\\int' in inner and '\\displaystyle' not in inner:
-                    # avoid f-string with backslash; use concatenation
-                    return '$' + '\\displaystyle ' + inner + '$'
-                return s
-            # \( ... \) inline
-            if s.startswith('\\(') and s.endswith('\\)'):
-                inner = s[2:-2]
-                if '\\int' in inner and '\\displaystyle' not in inner:
-                    # avoid f-string with backslash; use concatenation
-                    return '\\(' + '\\displaystyle ' + inner + '\\)'
-                return s
-            return s
-        return pattern.sub(repl, text)
+from assets import brotli, precompress, remove_stale, sync_files, write_hashed_json, write_json_asset
+from compact import DECODER_JS, encode_shard
+from corpus import collect_all_questions, image_digests, image_files, scan_questions_dir
+from dedupe import collapse_duplicates
+from devserver import LIVE_RELOAD_JS, serve_and_watch
+from images import available_formats, build_image_assets
+from mathrender import MATHJAX_CDN_URL, build_mathjax_bundle, prerender_questions
+from search import SEARCH_JS, write_search_index
 
-    for folder in output_folder.iterdir():
-        if folder.is_dir():
-            json_file = folder / "quiz_data.json"
-            if json_file.exists():
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    quiz_id = data.get('id')  # <- read quiz id from json (if present)
-                    for question in data.get('questions', []):
-                        # Find the image file in this folder
-                        image_files = list(folder.glob('*'))
-                        image_file = next((f for f in image_files if f.suffix.lower() in {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}), None)
-                        
-                        # process math in question and answers to prefer displaystyle for integrals
-                        question_text = question.get('question', '')
-                        question['question'] = process_math_inline(question_text)
-                        for ans in question.get('answers', []):
-                            ans_text = ans.get('text', '')
-                            ans['text'] = process_math_inline(ans_text)
-                        
-                        question['image'] = f"images/{folder.name}/{image_file.name}" if image_file else None
-                        question['source_folder'] = folder.name
-                        # attach quiz/folder id to each question (string)
-                        question['quiz_id'] = str(quiz_id) if quiz_id is not None else folder.name
-                        all_questions.append(question)
-    
-    return all_questions
+def write_question_shards(questions, build_folder, compact=False):
+    """Write one content-hashed JSON shard per category into build/data/.
 
-def generate_html(questions):
-    """Generate the static HTML file with all questions."""
+    With compact=True the shards use the dictionary-encoded format from
+    compact.py instead of plain record lists. Questions keep their corpus
+    order (the page shuffles them), so a rebuild only rewrites the shards
+    whose questions changed. Returns the shard index [{'name', 'count',
+    'url'}, ...] sorted by category name; the page inlines it and fetches
+    shards on demand.
+    """
+    data_folder = build_folder / "data"
+    by_category = {}
+    for q in questions:
+        by_category.setdefault(q.get('category', 'Matematika'), []).append(q)
     
-    # Extract unique categories
-    categories = sorted(set(q.get('category', 'Matematika') for q in questions))
+    shards = []
+    for name in sorted(by_category):
+        category_questions = by_category[name]
+        payload = encode_shard(category_questions) if compact else category_questions
+        file_name = write_hashed_json(data_folder, payload)
+        shards.append({'name': name, 'count': len(category_questions), 'url': f"data/{file_name}"})
+    remove_stale(data_folder, {shard['url'].removeprefix('data/') for shard in shards})
+    return shards
+
+def generate_html(shards, mathjax=None, search_url=None):
+    """Generate the static HTML page; questions are loaded from the category shards.
+
+    `mathjax` is the self-hosted bundle config from mathrender.build_mathjax_bundle;
+    without it the leftover TeX is typeset with the MathJax CDN build.
+    `search_url` is the search index from search.write_search_index, fetched
+    when the search box is first used; without it there is no search box.
+    """
     
-    # Shuffle questions for random order
-    shuffled_questions = questions.copy()
-    random.shuffle(shuffled_questions)
+    categories = [shard['name'] for shard in shards]
+    total_questions = sum(shard['count'] for shard in shards)
     
     html = """<!DOCTYPE html>
 <html lang="cs">
@@ -82,6 +57,8 @@ def generate_html(questions):
     <!-- favicon -->
     <link rel="icon" href="marnost.ico" type="image/x-icon">
     <link rel="shortcut icon" href="marnost.ico">
+    <!-- first category shard is fetched before the page script runs -->
+    """ + (f'<link rel="preload" href="{shards[0]["url"]}" as="fetch" crossorigin="anonymous" fetchpriority="high">' if shards else '') + """
     <script>
         MathJax = {
             tex: {
@@ -92,10 +69,18 @@ def generate_html(questions):
             },
             options: {
                 skipHtmlTags: ['script', 'noscript', 'style', 'textarea', 'pre']
-            }
-        };
+            },
+            startup: {
+                typeset: false
+            }""" + (f""",
+            // self-hosted subset: only the components this corpus needs
+            loader: {{
+                load: {json.dumps(mathjax['load'])},
+                paths: {{ mathjax: {json.dumps(mathjax['path'])} }}
+            }}""" if mathjax else '') + """
+        };""" + (f"""
+        MathJax.tex.packages = {{ '[+]': {json.dumps(mathjax['packages'])} }};""" if mathjax else '') + """
     </script>
-    <script src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
     <style>
         :root {
             --bg-primary: #0a0a0f;
@@ -594,6 +579,74 @@ def generate_html(questions):
             box-shadow: 0 4px 16px var(--accent-glow);
         }
         
+        .search-box {
+            position: relative;
+            margin-bottom: 20px;
+        }
+        
+        .search-input {
+            width: 100%;
+            background: var(--bg-input);
+            border: 2px solid var(--border);
+            border-radius: 16px;
+            color: var(--text-primary);
+            font: inherit;
+            padding: 12px 18px;
+            outline: none;
+            transition: border-color 0.2s;
+        }
+        
+        .search-input:focus {
+            border-color: var(--accent);
+        }
+        
+        .search-results {
+            display: none;
+            position: absolute;
+            top: calc(100% + 6px);
+            left: 0;
+            right: 0;
+            max-height: 60vh;
+            overflow-y: auto;
+            background: var(--bg-primary);
+            border: 2px solid var(--border);
+            border-radius: 16px;
+            box-shadow: 0 12px 48px var(--accent-glow);
+            z-index: 100;
+        }
+        
+        .search-results.visible {
+            display: block;
+        }
+        
+        .search-result,
+        .search-empty {
+            display: block;
+            width: 100%;
+            text-align: left;
+            background: none;
+            border: none;
+            border-bottom: 1px solid var(--border);
+            color: var(--text-primary);
+            font: inherit;
+            padding: 10px 18px;
+        }
+        
+        .search-result {
+            cursor: pointer;
+        }
+        
+        .search-result:hover {
+            background: var(--bg-tertiary);
+        }
+        
+        .search-result-meta,
+        .search-empty {
+            display: block;
+            font-size: 0.8em;
+            color: var(--text-secondary);
+        }
+        
         .stats-right {
             display: flex;
             gap: 20px;
@@ -691,6 +744,10 @@ def generate_html(questions):
             display: block;
         }
         
+        math[display="block"] {
+            margin: 0.6em 0;
+        }
+        
         .question-text {
             font-size: 1.1em;
             margin-bottom: 24px;
@@ -1149,13 +1206,19 @@ def generate_html(questions):
                     </div>
                 </div>
                 <div class="progress-bar-container">
-                    <div class="progress-fraction" id="progressFraction">0 / """ + str(len(shuffled_questions)) + """</div>
+                    <div class="progress-fraction" id="progressFraction">0 / """ + str(total_questions) + """</div>
                     <div class="progress">
                         <div class="progress-bar" id="sidebarProgressBar"></div>
                     </div>
                 </div>
             </div>
-            
+            """ + ('''
+            <div class="search-box">
+                <input type="search" class="search-input" id="searchInput" placeholder="Hledat otázku, např. cos \\frac{\\pi n}{2}"
+                       autocomplete="off" onfocus="loadSearchIndex()" oninput="runSearch(this.value)">
+                <div class="search-results" id="searchResults"></div>
+            </div>
+            ''' if search_url else '') + """
             <div class="content-wrapper">
                 <div class="container glass-card">
                     <div class="card-blob"></div>
@@ -1189,9 +1252,15 @@ def generate_html(questions):
     </div>
 
     <script>
-        const allQuestions = """ + json.dumps(shuffled_questions, ensure_ascii=False) + """;
         const categories = """ + json.dumps(categories, ensure_ascii=False) + """;
-        let filteredQuestions = [...allQuestions];
+        const categoryShards = """ + json.dumps([shard['url'] for shard in shards]) + """;
+        const imageFormats = """ + json.dumps([{'ext': ext, 'type': mime} for ext, mime, _ in available_formats()]) + """;
+        const shardRequests = [];
+        const searchIndexUrl = """ + json.dumps(search_url) + """;
+        let searchIndexRequest = null;
+        let filterGeneration = 0;
+        let seenUpTo = 0;
+        let filteredQuestions = [];
         let currentQuestion = 0;
         let userAnswers = [];
         let correctCount = 0;
@@ -1231,35 +1300,128 @@ def generate_html(questions):
             const index = Math.round((value - 0.8) / 0.1);
             document.getElementById('textSizeLabel').textContent = labels[index] || 'Normální';
             
-            if (window.MathJax) {
+            if (window.MathJax && MathJax.typesetPromise) {
                 MathJax.typesetClear();
                 MathJax.typesetPromise().catch((err) => console.log('MathJax error:', err));
             }
         }
         
         function shuffleQuestions() {
-            filteredQuestions.sort(() => Math.random() - 0.5);
+            shuffleArray(filteredQuestions);
             currentQuestion = 0;
             userAnswers = [];
             renderQuestion();
             closeSettings();
         }
 
-        function updateCategoryFilter() {
-            const selectedCategories = categories.filter((_, idx) => 
-                document.getElementById(`cat_${idx}`).checked
-            );
-            
-            if (selectedCategories.length === 0) {
-                filteredQuestions = [];
+        function shuffleArray(array) {
+            for (let i = array.length - 1; i > 0; i--) {
+                const j = Math.floor(Math.random() * (i + 1));
+                [array[i], array[j]] = [array[j], array[i]];
+            }
+            return array;
+        }
+""" + DECODER_JS + """
+        function loadCategory(idx, priority) {
+            // each category's questions live in their own content-hashed shard
+            if (!shardRequests[idx]) {
+                shardRequests[idx] = fetch(categoryShards[idx], { priority })
+                    .then(res => res.json())
+                    .then(decodeShard)
+                    .catch(err => {
+                        shardRequests[idx] = null;
+                        throw err;
+                    });
+            }
+            return shardRequests[idx];
+        }
+
+""" + SEARCH_JS + """
+        function loadSearchIndex() {
+            // the index is only fetched once someone starts searching
+            if (!searchIndexRequest) {
+                searchIndexRequest = fetch(searchIndexUrl)
+                    .then(res => res.json())
+                    .then(index => ({ ...index, lists: [] }))
+                    .catch(err => {
+                        searchIndexRequest = null;
+                        throw err;
+                    });
+            }
+            return searchIndexRequest;
+        }
+
+        function runSearch(query) {
+            const list = document.getElementById('searchResults');
+            if (!query.trim()) {
+                list.classList.remove('visible');
+                return;
+            }
+            loadSearchIndex()
+                .then(index => {
+                    if (document.getElementById('searchInput').value !== query) return;
+                    const items = searchIndex(index, query, 20).map(([quizId, cat, text]) => {
+                        const item = document.createElement('button');
+                        item.className = 'search-result';
+                        item.onclick = () => openSearchResult(quizId, cat);
+                        const meta = document.createElement('span');
+                        meta.className = 'search-result-meta';
+                        meta.textContent = `${categories[cat]} · ID: ${quizId}`;
+                        item.append(meta, text);
+                        return item;
+                    });
+                    if (items.length === 0) {
+                        const empty = document.createElement('div');
+                        empty.className = 'search-empty';
+                        empty.textContent = 'Nic nenalezeno';
+                        items.push(empty);
+                    }
+                    list.replaceChildren(...items);
+                    list.classList.add('visible');
+                })
+                .catch(err => console.log('Failed to load search index:', err));
+        }
+
+        function openSearchResult(quizId, cat) {
+            document.getElementById('searchResults').classList.remove('visible');
+            loadCategory(cat, 'high')
+                .then(questions => {
+                    const q = questions.find(q => q.quiz_id === quizId);
+                    if (!q) return;
+                    // jump to it if it is in the list, otherwise show it next
+                    let idx = filteredQuestions.indexOf(q);
+                    if (idx < 0) {
+                        idx = filteredQuestions.length === 0 ? 0 : seenUpTo + 1;
+                        filteredQuestions.splice(idx, 0, q);
+                    }
+                    currentQuestion = idx;
+                    renderQuestion();
+                })
+                .catch(err => console.log('Failed to load questions:', err));
+        }
+
+        function addQuestions(questions) {
+            // shuffle newly loaded questions into the part of the list not seen yet
+            const wasEmpty = filteredQuestions.length === 0;
+            const unseen = filteredQuestions.splice(wasEmpty ? 0 : seenUpTo + 1);
+            filteredQuestions.push(...shuffleArray(unseen.concat(questions)));
+            if (wasEmpty) {
+                renderQuestion();
             } else {
-                filteredQuestions = allQuestions.filter(q => 
-                    selectedCategories.includes(q.category || 'Matematika')
-                );
+                updateStats();
+                updateNavigationButtons();
             }
+        }
+
+        function updateCategoryFilter() {
+            const selected = categories
+                .map((_, idx) => idx)
+                .filter(idx => document.getElementById(`cat_${idx}`).checked);
             
-            filteredQuestions.sort(() => Math.random() - 0.5);
+            const generation = ++filterGeneration;
+            filteredQuestions = [];
             currentQuestion = 0;
+            seenUpTo = 0;
             userAnswers = [];
             answeredQuestions.clear();
             correctCount = 0;
@@ -1268,12 +1430,22 @@ def generate_html(questions):
             
             updateProgressFraction();
             
-            if (filteredQuestions.length > 0) {
+            if (selected.length === 0) {
                 renderQuestion();
-            } else {
-                document.getElementById('questionContainer').innerHTML = 
-                    '<div class="no-questions">Vyberte alespoň jednu kategorii pro trénování.</div>';
+                return;
             }
+            document.getElementById('questionContainer').innerHTML = 
+                '<div class="no-questions">Načítání otázek…</div>';
+            // the first selected category is fetched first, the rest as they come
+            selected.forEach((idx, i) => {
+                loadCategory(idx, i === 0 ? 'high' : 'low')
+                    .then(questions => {
+                        if (generation === filterGeneration) {
+                            addQuestions(questions);
+                        }
+                    })
+                    .catch(err => console.log('Failed to load questions:', err));
+            });
         }
 
         function selectAllCategories() {
@@ -1305,11 +1477,12 @@ def generate_html(questions):
             const q = filteredQuestions[currentQuestion];
             const container = document.getElementById('questionContainer');
             const controlsTop = document.getElementById('controlsTop');
+            seenUpTo = Math.max(seenUpTo, currentQuestion);
             
             // Render question with image at top if exists
             let html = '';
             if (q.image) {
-                html += `<img src="${q.image}" alt="Quiz question" class="question-image" id="questionImage">`;
+                html += renderImage(q);
             }
             
             html += `<div class="question-text">${q.question}</div>`;
@@ -1351,7 +1524,40 @@ def generate_html(questions):
             updateStats();
             updateNavigationButtons();
             
-            MathJax.typesetPromise([container]).catch((err) => console.log('MathJax error:', err));
+            // math is pre-rendered to MathML at build time; only leftovers need MathJax
+            if (q.math_fallback) {
+                typesetMath([container]);
+            }
+        }
+
+        let mathJaxReady = null;
+        function typesetMath(elements) {
+            if (!mathJaxReady) {
+                mathJaxReady = new Promise((resolve, reject) => {
+                    const script = document.createElement('script');
+                    script.src = """ + json.dumps(mathjax['url'] if mathjax else MATHJAX_CDN_URL) + """;
+                    script.async = true;
+                    script.onload = resolve;
+                    script.onerror = reject;
+                    document.head.appendChild(script);
+                }).then(() => MathJax.startup.promise);
+            }
+            return mathJaxReady
+                .then(() => MathJax.typesetPromise(elements))
+                .catch((err) => console.log('MathJax error:', err));
+        }
+
+        function renderImage(q) {
+            // AVIF/WebP width variants from the build, original screenshot as fallback
+            let sources = '';
+            if (q.image_variants) {
+                const v = q.image_variants;
+                sources = imageFormats.map(f => {
+                    const srcset = v.w.map((w, i) => `images/${v[f.ext][i]}.${f.ext} ${w}w`).join(', ');
+                    return `<source type="${f.type}" srcset="${srcset}" sizes="(max-width: 840px) 100vw, 800px">`;
+                }).join('');
+            }
+            return `<picture>${sources}<img src="${q.image}" alt="Quiz question" class="question-image" id="questionImage" decoding="async"></picture>`;
         }
 
         function updateNavigationButtons() {
@@ -1488,6 +1694,12 @@ def generate_html(questions):
         
         // Add keyboard navigation
         document.addEventListener('keydown', function(e) {
+            if (e.target.id === 'searchInput') {
+                if (e.key === 'Escape') {
+                    document.getElementById('searchResults').classList.remove('visible');
+                }
+                return;
+            }
             if (document.getElementById('settingsModal').classList.contains('visible') || 
                 !document.getElementById('welcomeOverlay').classList.contains('hidden')) {
                 return;
@@ -1536,7 +1748,7 @@ def generate_html(questions):
                 }
             });
             
-            renderQuestion();
+            updateCategoryFilter();
         });
     </script>
 </body>
@@ -1551,11 +1763,20 @@ def generate_html(questions):
     
     return html
 
-def main():
-    """Generate the static quiz site."""
+def build_site(compact=False, collapse=False, dev=False):
+    """Generate the static quiz site into build/ and return (questions, shards).
+
+    Every step reuses its cache, so a rebuild after an edit only redoes the
+    changed questions. dev=True is the watch-mode build: the page gets the
+    live-reload client and the files are not precompressed.
+    """
     print("Collecting questions...")
-    questions = collect_all_questions()
+    folders = scan_questions_dir(Path("./questions"))
+    questions = collect_all_questions(folders)
     print(f"Found {len(questions)} questions")
+    if collapse:
+        questions, removed = collapse_duplicates(questions)
+        print(f"Collapsed near-duplicates: {removed} questions dropped, {len(questions)} left")
     
     # Create build folder
     build_folder = Path("./build")
@@ -1573,42 +1794,68 @@ def main():
     else:
         print("Warning: marnost.ico not found; favicon will not be included in build.")
     
-    # Create images folder in build
-    images_folder = build_folder / "images"
-    if images_folder.exists():
-        shutil.rmtree(images_folder)
-    images_folder.mkdir()
+    # Publish screenshots and their WebP/AVIF variants under content-hashed names
+    cache_folder = Path("./.cache")
+    # only the screenshots of the published questions (--collapse-duplicates drops some)
+    used = {q['image'].removeprefix('images/') for q in questions if q.get('image')}
+    images = {rel: path for rel, path in image_files(folders).items() if rel in used}
+    image_info, image_assets, asset_manifest = build_image_assets(images, image_digests())
+    for q in questions:
+        if q.get('image'):
+            info = image_info[q['image']]
+            q['image'] = info['src']
+            q['image_variants'] = info['variants']
     
-    # Copy images from output to build
-    output_folder = Path("./questions")
-    for folder in output_folder.iterdir():
-        if folder.is_dir():
-            dest_folder = images_folder / folder.name
-            dest_folder.mkdir(exist_ok=True)
-            
-            # Copy only image files
-            for file in folder.iterdir():
-                if file.suffix.lower() in {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}:
-                    shutil.copy2(file, dest_folder / file.name)
+    # Sync images into build (only new/changed files are copied, orphans removed)
+    placed, unchanged, removed = sync_files(
+        image_assets, build_folder / "images", cache_folder / "build-images.json"
+    )
+    write_json_asset(build_folder / "asset-manifest.json", asset_manifest)
+    
+    # Index the TeX sources for the search box (before they are pre-rendered)
+    (build_folder / "assets").mkdir(exist_ok=True)
+    categories = sorted({q.get('category', 'Matematika') for q in questions})
+    search_url = write_search_index(questions, categories, build_folder / "assets")
+    print(f"Wrote search index to build/{search_url}")
+
+    # Pre-render LaTeX to MathML so the page does not typeset on every render
+    fallbacks = prerender_questions(questions)
+    print(f"Pre-rendered math ({fallbacks} questions still need MathJax)")
+    mathjax = build_mathjax_bundle(questions, build_folder / "assets")
+    
+    # Write per-category question shards
+    shards = write_question_shards(questions, build_folder, compact=compact)
+    print(f"Wrote {len(shards)} {'compact ' if compact else ''}category shards to build/data/")
     
     # Generate HTML
     print("Generating HTML...")
-    html_content = generate_html(questions)
+    html_content = generate_html(shards, mathjax, search_url)
+    if dev:
+        html_content = html_content.replace("</body>", f"<script>{LIVE_RELOAD_JS}</script>\n</body>", 1)
     
-    # Save index.html
-    with open(build_folder / "index.html", 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    # Save index.html (left untouched when unchanged, so it is not recompressed)
+    index_file = build_folder / "index.html"
+    if not index_file.exists() or index_file.read_text(encoding='utf-8') != html_content:
+        index_file.write_text(html_content, encoding='utf-8')
     
     # Create Dockerfile
-    dockerfile_content = """FROM nginx:alpine
+    dockerfile_content = """FROM alpine:3.20
+
+# nginx with the brotli module, to serve the precompressed .br/.gz files
+RUN apk add --no-cache nginx nginx-mod-http-brotli \\
+    && mkdir -p /usr/share/nginx/html \\
+    && ln -sf /dev/stdout /var/log/nginx/access.log \\
+    && ln -sf /dev/stderr /var/log/nginx/error.log
 
-# Copy the HTML file, favicon and images to nginx html directory
-COPY index.html /usr/share/nginx/html/
+# Copy the HTML file (with its .gz/.br siblings), favicon, images, question data and MathJax to nginx html directory
+COPY index.html* /usr/share/nginx/html/
 COPY images /usr/share/nginx/html/images
+COPY data /usr/share/nginx/html/data
+COPY assets /usr/share/nginx/html/assets
 COPY marnost.ico /usr/share/nginx/html/marnost.ico
 
 # Copy custom nginx configuration
-COPY nginx.conf /etc/nginx/conf.d/default.conf
+COPY nginx.conf /etc/nginx/http.d/default.conf
 
 # Expose port 80
 EXPOSE 80
@@ -1620,29 +1867,37 @@ CMD ["nginx", "-g", "daemon off;"]
         f.write(dockerfile_content)
     
     # Create nginx.conf
-    nginx_conf = """server {
+    nginx_conf = """# Content-hashed assets (images/<hash>.<ext>, data/<hash>.json, assets/mathjax-<hash>/) never change under
+# the same URL; everything else (index.html with the shard index, favicon) must be revalidated
+map $uri $cache_control {
+    ~^/(images|data|assets)/   "public, max-age=31536000, immutable";
+    default             "no-cache";
+}
+
+server {
     listen 80;
     server_name _;
     root /usr/share/nginx/html;
     index index.html;
 
-    # Gzip compression
+    # Serve the precompressed .br/.gz siblings written by generate.py
+    brotli_static on;
+    gzip_static on;
+
+    # Gzip compression for anything without a precompressed sibling
     gzip on;
     gzip_vary on;
     gzip_min_length 1024;
     gzip_types text/plain text/css text/xml text/javascript application/x-javascript application/xml+rss application/javascript application/json image/svg+xml;
 
-    # Cache static assets
-    location ~* \.(jpg|jpeg|png|gif|ico|css|js|svg|woff|woff2|ttf|eot)$ {
-        expires 1y;
-        add_header Cache-Control "public, immutable";
-    }
-
     # Serve index.html for all routes
     location / {
         try_files $uri $uri/ /index.html;
     }
 
+    # Caching (see map above)
+    add_header Cache-Control $cache_control;
+
     # Security headers
     add_header X-Frame-Options "SAMEORIGIN" always;
     add_header X-Content-Type-Options "nosniff" always;
@@ -1652,6 +1907,12 @@ CMD ["nginx", "-g", "daemon off;"]
     with open(build_folder / "nginx.conf", 'w', encoding='utf-8') as f:
         f.write(nginx_conf)
     
+    # Precompress text outputs for brotli_static/gzip_static
+    if dev:
+        # the dev server sends the plain files; compressing them would only slow down the rebuild
+        return questions, shards
+    compressed = precompress(build_folder)
+    
     # Create .dockerignore
     dockerignore = """.git
 .gitignore
@@ -1663,12 +1924,32 @@ Thumbs.db
         f.write(dockerignore)
     
     print(f"✓ Generated build/index.html with {len(questions)} questions")
-    print(f"✓ Copied images to build/images/")
+    print(f"✓ Synced images to build/images/ ({placed} copied, {unchanged} unchanged, {removed} removed)")
+    print(f"✓ Precompressed {compressed} text files (.gz{', .br' if brotli else ''})")
     print(f"✓ Created Dockerfile and nginx.conf for deployment")
     print(f"\nTo deploy on Railway:")
     print(f"1. cd build")
     print(f"2. Connect your Railway project")
     print(f"3. Railway will automatically detect and build the Dockerfile")
+    return questions, shards
+
+def main():
+    """Generate the static quiz site."""
+    parser = argparse.ArgumentParser(description="Generate the static quiz site into build/.")
+    parser.add_argument('--compact', action='store_true',
+                        help="write question shards in the compact dictionary-encoded format")
+    parser.add_argument('--collapse-duplicates', action='store_true',
+                        help="publish one question per near-duplicate cluster (see dedupe.py)")
+    parser.add_argument('--watch', action='store_true',
+                        help="serve build/ on localhost, rebuild when questions/ changes and reload the browser")
+    parser.add_argument('--port', type=int, default=8000, help="port of the --watch server")
+    args = parser.parse_args()
+
+    if args.watch:
+        serve_and_watch(lambda: build_site(args.compact, args.collapse_duplicates, dev=True),
+                        Path("./questions"), Path("./build"), args.port)
+    else:
+        build_site(args.compact, args.collapse_duplicates)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+"""Build-time screenshot optimization: WebP/AVIF width variants for <picture>/srcset."""
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from assets import HASH_LENGTH, file_digest, hashed_name, load_manifest, save_manifest
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only the original screenshots are served
+    Image = None
+
+VARIANT_WIDTHS = (480, 960, 1600)
+# (extension, MIME type, Pillow save options), preferred format first
+VARIANT_FORMATS = (
+    ('avif', 'image/avif', {'quality': 55, 'speed': 8}),
+    ('webp', 'image/webp', {'quality': 80, 'method': 6}),
+)
+# bump when widths or encoder settings change, so cached outputs get regenerated
+VARIANT_CACHE_VERSION = 1
+VARIANT_CACHE_DIR = Path("./.cache") / "images" / f"v{VARIANT_CACHE_VERSION}"
+VARIANT_MANIFEST_FILE = Path("./.cache") / f"image-variants-v{VARIANT_CACHE_VERSION}.json"
+
+
+def available_formats():
+    """Return the VARIANT_FORMATS entries the installed Pillow can encode."""
+    if Image is None:
+        return []
+    Image.init()
+    return [fmt for fmt in VARIANT_FORMATS if fmt[0].upper() in Image.SAVE]
+
+
+def variant_widths(width):
+    """Widths to emit for a source image: the presets below it, plus its own (capped) width."""
+    widths = [w for w in VARIANT_WIDTHS if w < width]
+    if width <= VARIANT_WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def encode_variants(src: Path, out_dir: Path, formats):
+    """Encode every width/format variant of src into out_dir; existing outputs are kept."""
+    with Image.open(src) as im:
+        im.load()
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'transparency' in im.info or 'A' in im.getbands() else 'RGB')
+        widths = variant_widths(im.width)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for w in widths:
+            resized = None
+            for ext, _, options in formats:
+                out = out_dir / f"{w}.{ext}"
+                if out.exists():
+                    continue
+                if resized is None:
+                    resized = im if w == im.width else im.resize((w, round(im.height * w / im.width)), Image.LANCZOS)
+                tmp = out.with_name(out.name + '.tmp')
+                resized.save(tmp, format=ext.upper(), **options)
+                os.replace(tmp, out)
+        return widths
+
+
+def _encode_job(job, formats):
+    rel, src, out_dir = job
+    try:
+        return encode_variants(src, out_dir, formats)
+    except OSError as e:
+        print(f"Warning: could not encode variants for {rel}: {e}")
+        return []
+
+
+def build_image_variants(digests, images, workers=None):
+    """Create cached WebP/AVIF variants for the question images.
+
+    `images` maps '<folder>/<name>' to the source screenshot (see
+    corpus.image_files) and `digests` maps the same keys to their content
+    hashes (see corpus.image_digests). Outputs live in .cache/images/, keyed
+    by the source hash, so a screenshot is only re-encoded when it changes.
+
+    Returns {source hash: {'widths': [...], 'outputs': {'<w>.<ext>': (path, digest)}}}.
+    """
+    formats = available_formats()
+    if not formats:
+        if Image is None:
+            print("Warning: Pillow not installed; serving original screenshots only.")
+        return {}
+
+    old_manifest = load_manifest(VARIANT_MANIFEST_FILE)
+    manifest = {}
+    todo = []
+    for rel, src in images.items():
+        digest = digests[rel]
+        if digest in manifest:
+            continue
+        entry = old_manifest.get(digest)
+        out_dir = VARIANT_CACHE_DIR / digest
+        names = [f"{w}.{ext}" for w in entry['widths'] for ext, _, _ in formats] if entry else []
+        if not names or not all(name in entry['outputs'] and (out_dir / name).exists() for name in names):
+            todo.append((rel, src, out_dir))
+            entry = None
+        manifest[digest] = entry
+
+    if todo:
+        print(f"Encoding image variants for {len(todo)} screenshots...")
+        # Pillow releases the GIL while resizing and encoding
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda job: _encode_job(job, formats), todo)
+            for (rel, _, out_dir), widths in zip(todo, results):
+                outputs = {}
+                for w in widths:
+                    for ext, _, _ in formats:
+                        outputs[f"{w}.{ext}"] = file_digest(out_dir / f"{w}.{ext}")
+                manifest[digests[rel]] = {'widths': widths, 'outputs': outputs}
+
+    if manifest != old_manifest:
+        save_manifest(VARIANT_MANIFEST_FILE, manifest)
+        # drop outputs of screenshots that changed or were removed
+        if VARIANT_CACHE_DIR.exists():
+            for out_dir in VARIANT_CACHE_DIR.iterdir():
+                if out_dir.name not in manifest:
+                    shutil.rmtree(out_dir)
+
+    return {
+        digest: {
+            'widths': entry['widths'],
+            'outputs': {name: (VARIANT_CACHE_DIR / digest / name, d) for name, d in entry['outputs'].items()},
+        }
+        for digest, entry in manifest.items() if entry['widths']
+    }
+
+
+def build_image_assets(images, digests, workers=None):
+    """Plan the content-hashed image assets for the site.
+
+    Every screenshot and variant is published as images/<hash>.<ext>, so a
+    corrected screenshot gets a new URL and the old one can be cached
+    forever. Identical screenshots in different folders share one file.
+    `digests` maps the keys of `images` to their content hashes, as the
+    question store keeps them (corpus.image_digests).
+
+    Returns (info, files, manifest):
+    - info maps each record's logical 'images/<folder>/<name>' path to
+      {'src': hashed URL, 'variants': {'w': [...], <ext>: [hash per width]} or None}
+    - files maps names under images/ to their source paths (for assets.sync_files)
+    - manifest maps every logical asset path to its hashed path
+    """
+    variants = build_image_variants(digests, images, workers)
+    formats = available_formats()
+
+    info = {}
+    files = {}
+    manifest = {}
+    for rel, src in images.items():
+        digest = digests[rel]
+        name = hashed_name(digest, PurePosixPath(rel).suffix.lower())
+        files[name] = src
+        manifest[f"images/{rel}"] = f"images/{name}"
+        v = variants.get(digest)
+        if v:
+            stem = PurePosixPath(rel).with_suffix('').as_posix()
+            image_variants = {'w': v['widths']}
+            for ext, _, _ in formats:
+                image_variants[ext] = []
+                for w in v['widths']:
+                    path, out_digest = v['outputs'][f"{w}.{ext}"]
+                    variant_name = hashed_name(out_digest, f".{ext}")
+                    files[variant_name] = path
+                    manifest[f"images/{stem}-{w}.{ext}"] = f"images/{variant_name}"
+                    image_variants[ext].append(out_digest[:HASH_LENGTH])
+        else:
+            image_variants = None
+        info[f"images/{rel}"] = {'src': f"images/{name}", 'variants': image_variants}
+    return info, files, manifest
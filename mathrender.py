@@ -0,0 +1,205 @@
+"""Build-time LaTeX pre-rendering: $...$, $$...$$, \\(...\\) and \\[...\\] to static MathML."""
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+
+from assets import HASH_LENGTH, file_digest, load_manifest, place_file, save_manifest
+
+try:
+    from latex2mathml.converter import convert as latex_to_mathml
+except ImportError:  # optional; without it all math is left for MathJax in the browser
+    latex_to_mathml = None
+
+# same delimiters as the MathJax config in generate_html
+SEGMENT_PATTERN = re.compile(r'\$\$(.+?)\$\$|\\\[(.+?)\\\]|\$(.+?)\$|\\\((.+?)\\\)', re.DOTALL)
+ENTITY_PATTERN = re.compile(r'&#x([0-9A-Fa-f]+);')
+# bump when the conversion or post-processing changes, so cached segments get re-rendered
+MATH_CACHE_VERSION = 1
+MATH_CACHE_FILE = Path("./.cache") / f"math-v{MATH_CACHE_VERSION}.json"
+
+
+def _entity_repl(m):
+    ch = chr(int(m.group(1), 16))
+    # keep the characters that are markup in HTML escaped
+    return m.group(0) if ch in '<>&"' else ch
+
+
+def render_segment(tex: str, display: bool):
+    """Render one TeX segment to MathML, or None if it cannot be converted faithfully."""
+    try:
+        mathml = latex_to_mathml(tex, display='block' if display else 'inline')
+    except Exception:
+        return None
+    # unknown commands come through as literal text; leave those to MathJax
+    if '\\' in mathml:
+        return None
+    # trim what the HTML parser does not need; single quotes avoid escaping inside JSON
+    mathml = mathml.replace(' xmlns="http://www.w3.org/1998/Math/MathML"', '', 1)
+    mathml = mathml.replace(' display="inline"', '', 1).replace('"', "'")
+    return ENTITY_PATTERN.sub(_entity_repl, mathml)
+
+
+def render_text(text: str, cache, used):
+    """Replace the TeX segments in text with MathML.
+
+    `cache` holds MathML (or None for failures) by segment hash from earlier
+    builds; every segment looked up is recorded in `used`. Returns
+    (rendered text, number of segments left as TeX).
+    """
+    if not text:
+        return text, 0
+    left = 0
+
+    def repl(m):
+        nonlocal left
+        display = m.group(1) is not None or m.group(2) is not None
+        tex = next(g for g in m.groups() if g is not None)
+        if latex_to_mathml is None:
+            left += 1
+            return m.group(0)
+        key = hashlib.sha256(f"{int(display)}{tex}".encode('utf-8')).hexdigest()[:20]
+        mathml = cache[key] if key in cache else render_segment(tex, display)
+        used[key] = mathml
+        if mathml is None:
+            left += 1
+            return m.group(0)
+        return mathml
+
+    return SEGMENT_PATTERN.sub(repl, text), left
+
+
+def prerender_questions(questions, cache_file: Path = MATH_CACHE_FILE):
+    """Pre-render the math of all question records in place.
+
+    Records with segments that could not be converted keep those as TeX and
+    get 'math_fallback': True, so the page only typesets them in the browser.
+    Returns the number of such records.
+    """
+    if latex_to_mathml is None:
+        print("Warning: latex2mathml not installed; math will be typeset by MathJax in the browser.")
+    cache = load_manifest(cache_file) if latex_to_mathml else {}
+    used = {}
+    fallbacks = 0
+    for q in questions:
+        q['question'], left = render_text(q.get('question', ''), cache, used)
+        for ans in q.get('answers', []):
+            ans['text'], ans_left = render_text(ans.get('text', ''), cache, used)
+            left += ans_left
+        if left:
+            q['math_fallback'] = True
+            fallbacks += 1
+    # keep only the segments used by this build in the cache
+    if latex_to_mathml and used != cache:
+        save_manifest(cache_file, used)
+    return fallbacks
+
+
+# Self-hosted MathJax for the segments left as TeX. Components are copied from
+# a local `mathjax` npm package (v3, es5 build) when one is available.
+MATHJAX_CDN_URL = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js'
+MATHJAX_SEARCH_PATHS = (Path("./node_modules/mathjax/es5"), Path("./nextjs/node_modules/mathjax/es5"))
+COMMAND_PATTERN = re.compile(r'\\begin\{([A-Za-z]+\*?)\}|\\([A-Za-z]+)')
+# TeX commands and environments -> the MathJax extension that defines them
+# (everything else is in the base package; unknown macros are shown by noundefined)
+TEX_EXTENSIONS = {
+    'ams': {
+        'dfrac', 'tfrac', 'binom', 'dbinom', 'tbinom', 'genfrac', 'operatorname', 'DeclareMathOperator',
+        'iint', 'iiint', 'iiiint', 'idotsint', 'mathbb', 'mathfrak', 'boxed', 'substack', 'xrightarrow',
+        'xleftarrow', 'lvert', 'rvert', 'lVert', 'rVert', 'leqslant', 'geqslant', 'varnothing', 'nmid',
+        'implies', 'impliedby', 'intertext', 'tag', 'eqref', 'align', 'align*', 'aligned', 'gather',
+        'gather*', 'gathered', 'multline', 'split', 'cases', 'matrix', 'pmatrix', 'bmatrix', 'Bmatrix',
+        'vmatrix', 'Vmatrix', 'smallmatrix', 'subarray',
+    },
+    'boldsymbol': {'boldsymbol'},
+    'cancel': {'cancel', 'bcancel', 'xcancel', 'cancelto'},
+    'color': {'color', 'textcolor', 'colorbox', 'fcolorbox', 'definecolor'},
+    'mathtools': {'coloneqq', 'eqqcolon', 'dcases', 'rcases', 'prescript', 'mathclap', 'shortintertext'},
+    'newcommand': {'newcommand', 'renewcommand', 'def', 'let', 'newenvironment'},
+    'mhchem': {'ce', 'pu'},
+    'braket': {'bra', 'ket', 'braket', 'Bra', 'Ket', 'Braket', 'set', 'Set'},
+    'bbox': {'bbox'},
+    'enclose': {'enclose'},
+    'unicode': {'unicode'},
+}
+# CHTML web fonts: always needed, plus the ones for the alphabet commands used
+BASE_FONTS = ('Main-Regular', 'Main-Bold', 'Main-Italic', 'Math-Italic', 'Math-BoldItalic', 'Zero',
+              'Size1-Regular', 'Size2-Regular', 'Size3-Regular', 'Size4-Regular', 'AMS-Regular')
+COMMAND_FONTS = {
+    'mathcal': ('Calligraphic-Regular', 'Calligraphic-Bold'),
+    'mathfrak': ('Fraktur-Regular', 'Fraktur-Bold'),
+    'mathscr': ('Script-Regular',),
+    'mathsf': ('SansSerif-Regular', 'SansSerif-Bold', 'SansSerif-Italic'),
+    'mathtt': ('Typewriter-Regular',),
+    'vec': ('Vector-Regular', 'Vector-Bold'),
+}
+
+
+def find_mathjax():
+    """Return the es5/ folder of a local MathJax 3 package ($MATHJAX_DIR first), or None."""
+    candidates = [Path(os.environ['MATHJAX_DIR'])] if os.environ.get('MATHJAX_DIR') else []
+    candidates.extend(MATHJAX_SEARCH_PATHS)
+    return next((d for d in candidates if (d / 'startup.js').exists()), None)
+
+
+def tex_commands(questions):
+    """Collect the TeX command and environment names in the math still left as TeX."""
+    used = set()
+    for q in questions:
+        if not q.get('math_fallback'):
+            continue
+        texts = [q.get('question', '')] + [ans.get('text', '') for ans in q.get('answers', [])]
+        for text in texts:
+            for segment in SEGMENT_PATTERN.finditer(text or ''):
+                used.update(a or b for a, b in COMMAND_PATTERN.findall(segment.group(0)))
+    return used
+
+
+def build_mathjax_bundle(questions, assets_folder: Path):
+    """Publish the MathJax components the leftover TeX needs into assets_folder.
+
+    The corpus is scanned for the commands still typeset in the browser, and
+    only tex-base, the extensions defining them, the CHTML output and the web
+    fonts for the alphabets used are copied, into mathjax-<hash>/ named after
+    the content of the whole subset. Returns the page config
+    {'url', 'path', 'load', 'packages'}, or None when no math needs MathJax
+    or no local MathJax is installed (the page then uses the CDN build).
+    """
+    mathjax_dir = find_mathjax()
+    commands = tex_commands(questions)
+    if mathjax_dir is None or not commands:
+        if commands:
+            print("Warning: no local MathJax found (set MATHJAX_DIR); the page will load it from the CDN.")
+        for old in assets_folder.glob('mathjax-*'):
+            shutil.rmtree(old)
+        return None
+
+    packages = sorted(pkg for pkg, names in TEX_EXTENSIONS.items() if commands & names) + ['noundefined']
+    fonts = list(BASE_FONTS)
+    for command, names in COMMAND_FONTS.items():
+        if command in commands:
+            fonts.extend(names)
+    load = ['core', 'input/tex-base'] + [f'[tex]/{pkg}' for pkg in packages] + ['output/chtml', 'output/chtml/fonts/tex']
+
+    files = ['startup.js'] + [f"{name.replace('[tex]', 'input/tex/extensions')}.js" for name in load]
+    files += [f'output/chtml/fonts/woff-v2/MathJax_{font}.woff' for font in fonts]
+    files = [f for f in files if (mathjax_dir / f).exists()]
+    h = hashlib.sha256()
+    for rel in files:
+        h.update(f"{rel}\0{file_digest(mathjax_dir / rel)}\0".encode('utf-8'))
+    bundle = f"mathjax-{h.hexdigest()[:HASH_LENGTH]}"
+
+    # the folder name covers its whole content, so an existing one is complete
+    bundle_dir = assets_folder / bundle
+    if not bundle_dir.exists():
+        tmp_dir = assets_folder / (bundle + '.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        for rel in files:
+            place_file(mathjax_dir / rel, tmp_dir / rel)
+        os.replace(tmp_dir, bundle_dir)
+    for old in assets_folder.glob('mathjax-*'):
+        if old.name != bundle:
+            shutil.rmtree(old)
+    print(f"Self-hosted MathJax subset: tex-base + {', '.join(packages)}, {len(files)} files")
+    return {'url': f"assets/{bundle}/startup.js", 'path': f"assets/{bundle}", 'load': load, 'packages': packages}
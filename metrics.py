@@ -0,0 +1,120 @@
+"""Per-image metrics for resolve.py runs and the report printed at the end of a run."""
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_DIR = Path("./.cache") / "resolve-metrics"
+
+_local = threading.local()
+
+
+@contextmanager
+def metrics_scope(record):
+    """Collect record_metric calls made on this thread into `record` (a dict) and time the block."""
+    previous = getattr(_local, 'record', None)
+    _local.record = record
+    start = time.monotonic()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = round(record.get('wall_seconds', 0) + time.monotonic() - start, 4)
+        _local.record = previous
+
+
+def record_metric(name, value, add=False):
+    """Set (or with add=True, increase) a metric of the image processed on this thread.
+
+    Calls outside metrics_scope are ignored, so instrumented helpers work
+    the same when called on their own.
+    """
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return
+    if add:
+        value = record.get(name, 0) + value
+    record[name] = round(value, 4) if isinstance(value, float) else value
+
+
+class MetricsLog:
+    """JSONL file with one metrics record per image."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_metrics(path: Path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of values, interpolating between the closest ranks."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+# (metric, label, format) rows of the distribution table
+REPORT_DISTRIBUTIONS = (
+    ('wall_seconds', 'wall time per image (s)', '{:.2f}'),
+    ('model_seconds', 'model time per image (s)', '{:.2f}'),
+    ('upload_bytes', 'upload size (KB)', lambda v: f"{v / 1024:.0f}"),
+    ('response_bytes', 'response size (B)', '{:.0f}'),
+)
+
+
+def format_report(records, elapsed=None):
+    """Summarize metrics records: counts, percentiles, totals and a failure breakdown."""
+    ok = [r for r in records if r.get('status') == 'ok']
+    failed = [r for r in records if r.get('status') == 'failed']
+    skipped = sum(1 for r in records if r.get('status') == 'skipped')
+    lines = [f"Run report: {len(records)} images, {len(ok)} converted, {len(failed)} failed, {skipped} skipped"]
+    if elapsed:
+        lines[0] += f", {elapsed:.1f}s wall ({len(ok) / elapsed:.2f} images/s)"
+
+    lines.append(f"  {'':26} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for name, label, fmt in REPORT_DISTRIBUTIONS:
+        values = [r[name] for r in records if name in r and r.get('status') != 'skipped']
+        if not values:
+            continue
+        show = fmt if callable(fmt) else fmt.format
+        cells = [show(percentile(values, q)) for q in (50, 90, 99, 100)]
+        lines.append(f"  {label:26} " + " ".join(f"{c:>8}" for c in cells))
+
+    def total(name):
+        return sum(r.get(name, 0) for r in records)
+
+    saved = total('original_bytes') - total('upload_bytes')
+    lines.append(
+        f"  model calls {total('model_calls'):g}, retries {total('retries'):g}, cache hits "
+        f"{sum(1 for r in records if r.get('cache_hit'))}, batched images {sum(1 for r in records if r.get('batch_size', 1) > 1)}"
+    )
+    lines.append(
+        f"  escape repair fired {sum(1 for r in records if r.get('escape_repaired'))}, syntax fixes "
+        f"{sum(1 for r in records if r.get('syntax_fix'))}, re-asked fields {total('followup_fields')}, "
+        f"upload bytes saved {saved:,}"
+    )
+    if failed:
+        lines.append("  failures:")
+        breakdown = Counter((r.get('error_type', '?'), r.get('failed_after') or 'start') for r in failed)
+        for (error_type, stage), count in breakdown.most_common():
+            lines.append(f"    {count:4d} × {error_type} after '{stage}'")
+    return "\n".join(lines)
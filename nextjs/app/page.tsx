@@ -1,10 +1,10 @@
 'use client';
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import CategorySelector from '@/components/CategorySelector';
 import QuizQuestion from '@/components/QuizQuestion';
 import LatexRenderer from '@/components/LatexRenderer';
-import { Question } from '@/lib/types';
+import { CategoryIndex, Question } from '@/lib/types';
 import {
   Table,
   TableBody,
@@ -14,12 +14,24 @@ import {
   TableRow,
 } from '@/components/ui/table';
 
+// Fisher-Yates shuffle in place
+function shuffleIndices(indices: number[]): number[] {
+  for (let i = indices.length - 1; i > 0; i--) {
+    const j = Math.floor(Math.random() * (i + 1));
+    [indices[i], indices[j]] = [indices[j], indices[i]];
+  }
+  return indices;
+}
+
 export default function Home() {
   const [questions, setQuestions] = useState<Question[]>([]);
   const [categories, setCategories] = useState<string[]>([]);
+  const [categoryQuestions, setCategoryQuestions] = useState<number[][]>([]);
   const [selectedCategories, setSelectedCategories] = useState<string[]>([]);
   const [currentQuestionIndex, setCurrentQuestionIndex] = useState(0);
-  const [filteredQuestions, setFilteredQuestions] = useState<Question[]>([]);
+  // indices into questions of the selected categories, in practice order
+  const [order, setOrder] = useState<number[]>([]);
+  const pendingJump = useRef<number | null>(null);
   const [isSubmitted, setIsSubmitted] = useState(false);
   const [score, setScore] = useState({ correct: 0, incorrect: 0 });
   const [showCategorySelector, setShowCategorySelector] = useState(false);
@@ -35,13 +47,14 @@ export default function Home() {
   const [expandedQuestions, setExpandedQuestions] = useState<Set<string>>(new Set());
 
   useEffect(() => {
-    fetch('/questions.json')
-      .then((res) => res.json())
-      .then((data: Question[]) => {
-        setQuestions(data);
-        const uniqueCategories = Array.from(new Set(data.map((q) => q.category)));
-        setCategories(uniqueCategories.sort());
-      });
+    Promise.all([
+      fetch('/questions.json').then((res) => res.json()),
+      fetch('/categories.json').then((res) => res.json()),
+    ]).then(([data, index]: [Question[], CategoryIndex]) => {
+      setQuestions(data);
+      setCategories(index.categories);
+      setCategoryQuestions(index.questions);
+    });
 
     // Load stats from localStorage
     const savedStats = localStorage.getItem('questionStats');
@@ -54,20 +67,20 @@ export default function Home() {
     if (statsEnabledSetting !== null) {
       setStatsEnabled(statsEnabledSetting === 'true');
     }
-  }, []); useEffect(() => {
-    if (selectedCategories.length > 0) {
-      const filtered = questions.filter((q) =>
-        selectedCategories.includes(q.category)
-      );
-      setFilteredQuestions(filtered);
-      if (currentQuestionIndex >= filtered.length) {
-        setCurrentQuestionIndex(Math.max(0, filtered.length - 1));
-      }
-    } else {
-      setFilteredQuestions([]);
-      setCurrentQuestionIndex(0);
-    }
-  }, [selectedCategories, questions, currentQuestionIndex]);
+  }, []);
+
+  useEffect(() => {
+    // concatenate the selected categories' index arrays and shuffle the indices, not the questions
+    const selected = new Set(selectedCategories);
+    const next = shuffleIndices(
+      categories.flatMap((category, id) => (selected.has(category) ? categoryQuestions[id] : []))
+    );
+    // stay on the pending question if it is still selected, otherwise keep the position (clamped)
+    const jump = pendingJump.current === null ? -1 : next.indexOf(pendingJump.current);
+    pendingJump.current = null;
+    setOrder(next);
+    setCurrentQuestionIndex((prev) => (jump !== -1 ? jump : Math.max(0, Math.min(prev, next.length - 1))));
+  }, [selectedCategories, categories, categoryQuestions]);
 
   useEffect(() => {
     const handleKeyDown = (e: KeyboardEvent) => {
@@ -82,9 +95,11 @@ export default function Home() {
 
     window.addEventListener('keydown', handleKeyDown);
     return () => window.removeEventListener('keydown', handleKeyDown);
-  }, [currentQuestionIndex, filteredQuestions.length, showAboutModal, showStatsModal]);
+  }, [currentQuestionIndex, order.length, showAboutModal, showStatsModal]);
 
   const toggleCategory = (category: string) => {
+    // keep the current question when its category stays selected
+    pendingJump.current = order[currentQuestionIndex] ?? null;
     setSelectedCategories((prev) =>
       prev.includes(category)
         ? prev.filter((c) => c !== category)
@@ -150,7 +165,7 @@ export default function Home() {
   };
 
   const handleNext = () => {
-    if (currentQuestionIndex < filteredQuestions.length - 1) {
+    if (currentQuestionIndex < order.length - 1) {
       setCurrentQuestionIndex((prev) => prev + 1);
       setIsSubmitted(false);
       setShowImage(false);
@@ -158,28 +173,20 @@ export default function Home() {
   };
 
   const jumpToQuestion = (quizId: string) => {
-    // Find the question in all questions
-    const question = questions.find(q => q.quiz_id === quizId);
-    if (!question) return;
+    const questionIndex = questions.findIndex(q => q.quiz_id === quizId);
+    if (questionIndex === -1) return;
+    const question = questions[questionIndex];
 
-    // Ensure the category is selected
-    if (!selectedCategories.includes(question.category)) {
+    if (selectedCategories.includes(question.category)) {
+      setCurrentQuestionIndex(order.indexOf(questionIndex));
+    } else {
+      // the new order is built when the category is selected; it starts at this question
+      pendingJump.current = questionIndex;
       setSelectedCategories(prev => [...prev, question.category]);
     }
-
-    // Wait for filteredQuestions to update, then find and jump to the question
-    setTimeout(() => {
-      const filtered = questions.filter((q) =>
-        selectedCategories.includes(q.category) || q.category === question.category
-      );
-      const index = filtered.findIndex(q => q.quiz_id === quizId);
-      if (index !== -1) {
-        setCurrentQuestionIndex(index);
-        setIsSubmitted(false);
-        setShowImage(false);
-        setShowStatsModal(false);
-      }
-    }, 100);
+    setIsSubmitted(false);
+    setShowImage(false);
+    setShowStatsModal(false);
   };
 
   const resetStats = () => {
@@ -282,7 +289,7 @@ export default function Home() {
     setExpandedQuestions(newExpanded);
   };
 
-  const currentQuestion = filteredQuestions[currentQuestionIndex];
+  const currentQuestion = questions[order[currentQuestionIndex]];
 
   return (
     <div className="min-h-screen bg-[#0a0a0f] flex flex-col items-center py-8 px-4 relative">
@@ -316,7 +323,7 @@ export default function Home() {
 
       {/* Main Content - Question and Controls */}
       <div className="flex-1 flex items-center justify-center w-full max-w-4xl relative z-[1] px-2 md:px-0">
-        {filteredQuestions.length > 0 ? (
+        {order.length > 0 ? (
           <div className="w-full space-y-3 md:space-y-4">
             {/* Question Island */}
             <div className="rounded-2xl md:rounded-3xl bg-[rgba(20,20,30,0.6)] backdrop-blur-xl border border-purple-500/10 shadow-[0_8px_32px_rgba(0,0,0,0.4),0_0_0_1px_rgba(139,92,246,0.05)_inset] p-4 md:p-8">
@@ -366,12 +373,12 @@ export default function Home() {
                   </button>
 
                   <span className="text-sm md:text-sm text-zinc-400 font-medium min-w-[70px] md:min-w-[60px] text-center">
-                    {currentQuestionIndex + 1} / {filteredQuestions.length}
+                    {currentQuestionIndex + 1} / {order.length}
                   </span>
 
                   <button
                     onClick={handleNext}
-                    disabled={currentQuestionIndex === filteredQuestions.length - 1}
+                    disabled={currentQuestionIndex === order.length - 1}
                     className="p-2.5 md:p-2 rounded-xl bg-[rgba(30,30,45,0.6)] backdrop-blur-[10px] border border-purple-500/20 text-purple-300 transition-all hover:bg-purple-500/20 hover:border-purple-500/40 hover:-translate-y-0.5 hover:shadow-[0_4px_16px_rgba(139,92,246,0.3)] disabled:opacity-30 disabled:cursor-not-allowed disabled:hover:translate-y-0 disabled:hover:bg-[rgba(30,30,45,0.6)] active:scale-95"
                   >
                     <svg className="w-5 h-5 md:w-5 md:h-5" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -10,6 +10,14 @@ export interface Question {
     image_src: string;
     source_folder: string;
     quiz_id: string;
+    // index into categories.json; the committed questions.json predates it
+    category_id?: number;
+}
+
+// public/categories.json: category names by id and, per category id, the indices of its questions
+export interface CategoryIndex {
+    categories: string[];
+    questions: number[][];
 }
 
 export interface QuestionStats {
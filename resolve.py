@@ -1,23 +1,53 @@
+import argparse
+import difflib
+import hashlib
 import os
 import json
-import google.generativeai as genai
+import random
+import re
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
 
-# Configure the API key (set your API key as environment variable)
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
+from assets import file_digest
+from backends import BACKENDS, GeminiBackend, TransientModelError
+from corpus import image_files as question_image_files, scan_questions_dir
+from metrics import METRICS_DIR, MetricsLog, format_report, load_metrics, metrics_scope, record_metric
+from screenshots import DUPLICATE_DISTANCE, PreprocessOptions, dhash, dhash_index, find_near_duplicates, preprocess_screenshot
 
-# Use Gemini 1.5 Pro for best image understanding
-model = genai.GenerativeModel('gemini-2.5-flash')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
+# retry delays: RETRY_BASE_DELAY * 2**attempt seconds (with jitter), capped
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+# model responses by response_cache_key (image, prompt and model)
+RESPONSE_CACHE_DIR = Path("./.cache") / "responses"
+# expected shape of one screenshot's answer, see quiz_problems
+EXPECTED_ANSWERS = 4
+FOLLOWUP_ROUNDS = 2
+JSON_STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+JSON_ESCAPE_PATTERN = re.compile(r'\\(u[0-9A-Fa-f]{4}|[A-Za-z]+|.)', re.DOTALL)
+FIELD_PATH_PATTERN = re.compile(r'[^.\[\]]+')
+HEX_DIGITS = set('0123456789abcdefABCDEF')
+# a doubly escaped unicode escape ("\\u0165"); never meant as a LaTeX line break before "u0165"
+DOUBLE_UNICODE_ESCAPE_PATTERN = re.compile(r'\\\\(u[0-9A-Fa-f]{4})')
+# LaTeX commands starting with "n", which would otherwise read as a JSON newline
+LATEX_N_COMMANDS = {
+    'nabla', 'natural', 'ne', 'nearrow', 'neg', 'neq', 'newline', 'nexists', 'ngeq', 'ngtr', 'ni', 'nleftarrow',
+    'nleq', 'nless', 'nmid', 'nolimits', 'nonumber', 'nparallel', 'nrightarrow', 'nsim', 'nsubseteq',
+    'nsupseteq', 'nu', 'nwarrow',
+}
+# progress of every image, see Journal
+JOURNAL_FILE = Path("./.cache") / "resolve-journal.jsonl"
+JOB_STATES = ('queued', 'uploaded', 'responded', 'parsed', 'written', 'cleaned')
+# quiz_data.json key listing hand-corrected field paths (or true for the whole file) that reparse keeps
+MANUAL_KEY = 'manual'
 
-def process_quiz_image(image_path):
-    """Process a single quiz image and extract structured data."""
-    
-    # Load the image
-    img = Image.open(image_path)
-    
-    # Create a detailed prompt for the AI
-    prompt = """
+# Detailed prompt for the model (part of the response cache key)
+PROMPT = """
     Analyze this math quiz image and extract all information in a structured format.
     
     IMPORTANT: This is a multiple-choice quiz where ONE question has FOUR answer options.
@@ -81,14 +111,238 @@ def process_quiz_image(image_path):
     - All mathematical notation is properly formatted in LaTeX with DOUBLE backslashes in JSON
     - Greek letters like \\alpha, \\beta, \\varphi MUST have double backslashes
     """
+
+# Several screenshots in one request: each follows an "IMAGE <id>" line and the
+# answer is keyed by id, so one copy of the instructions serves the whole batch
+BATCH_PROMPT = """
+    You will receive several quiz screenshots. Each screenshot follows a line
+    "IMAGE <id>" that identifies it. Handle every screenshot on its own, exactly
+    as the instructions below describe for a single image, and return ONLY valid
+    JSON keyed by the image ids, with one entry for every image:
+    {
+        "images": {
+            "<id>": {"questions": [ ... ]}
+        }
+    }
+    where each "questions" array is in the single-image format described below.
+    """ + PROMPT
+
+# Follow-up requests when a response does not validate; much smaller than PROMPT
+SYNTAX_FIX_PROMPT = """
+    The text below should be a single JSON object but it does not parse ({error}).
+    Return ONLY the corrected JSON. Change nothing but the JSON syntax; keep LaTeX
+    backslashes doubled inside strings ("\\\\frac", not "\\frac").
+
+    {text}
+    """
+FIELD_FIX_PROMPT = """
+    You transcribed the attached math quiz screenshot into this JSON:
+    {current}
+
+    These fields are wrong:
+{problems}
+
+    Look at the screenshot again and return ONLY a JSON object that maps each listed
+    field path to its corrected value, for example {{"questions[0].answers[2].correct": false}}.
+    The quiz has exactly ONE question with FOUR answers; "correct" is true when the
+    answer is marked as correct in the image. Use LaTeX for math with DOUBLE
+    backslashes inside JSON strings.
+    """
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Return the default (Gemini) backend, shared by all callers."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = GeminiBackend()
+        return _model
+
+
+class RateLimiter:
+    """Thread-safe token bucket: at most `rate` calls per second, bursts up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient(error):
+    """Whether a failed model call is worth retrying (rate limits, timeouts, 5xx)."""
+    return isinstance(error, (TransientModelError, ConnectionError, TimeoutError))
+
+
+def call_with_retry(func, limiter=None, retries=5, label=""):
+    """Call func(), waiting for the rate limiter first and retrying transient errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        start = time.monotonic()
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            record_metric('retries', 1, add=True)
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"  {label}: transient error ({e}); retry {attempt + 1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+        finally:
+            record_metric('model_calls', 1, add=True)
+            record_metric('model_seconds', time.monotonic() - start, add=True)
+
+
+def write_text_atomic(path: Path, text):
+    tmp_file = path.with_name(path.name + '.tmp')
+    tmp_file.write_text(text, encoding='utf-8')
+    os.replace(tmp_file, path)
+
+
+def prepare_upload(image_path, preprocess=None):
+    """Path of the image to send to the model: the pre-processed screenshot if enabled, else the original."""
+    if preprocess is None:
+        size = os.path.getsize(image_path)
+        record_metric('original_bytes', size)
+        record_metric('upload_bytes', size)
+        return image_path
+    upload_path, before, after = preprocess_screenshot(image_path, preprocess)
+    record_metric('original_bytes', before)
+    record_metric('upload_bytes', after)
+    print(f"  {image_path.name}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB "
+          f"({before - after:,} bytes saved)")
+    return upload_path
+
+
+def response_cache_key(image_path, model, prompt=PROMPT):
+    """Cache key for a model response: hash of (image bytes, prompt text, model name)."""
+    h = hashlib.sha256()
+    h.update(file_digest(image_path).encode('ascii'))
+    h.update(hashlib.sha256(prompt.encode('utf-8')).hexdigest().encode('ascii'))
+    h.update(getattr(model, 'model_name', type(model).__name__).encode('utf-8'))
+    return h.hexdigest()
+
+
+def process_quiz_image(image_path, model=None, limiter=None, retries=0, refresh=False,
+                       cache_dir=RESPONSE_CACHE_DIR):
+    """Process a single quiz image and return the model's raw response text.
+
+    Responses are cached in cache_dir by response_cache_key, so the same
+    image, prompt and model is only ever sent once unless refresh is set
+    (offline backends are never cached, see backends.py).
+    Model calls wait for `limiter` and retry transient errors (see call_with_retry).
+    """
+    if model is None:
+        model = get_model()
+    cacheable = getattr(model, 'cacheable', True)
+    cache_file = cache_dir / f"{response_cache_key(image_path, model)}.txt"
+    if cacheable and not refresh and cache_file.exists():
+        record_metric('cache_hit', True)
+        return cache_file.read_text(encoding='utf-8')
+    
+    # Load the image
+    img = Image.open(image_path)
     
     # Generate content with the image
-    response = model.generate_content([prompt, img])
+    response = call_with_retry(lambda: model.generate_content([PROMPT, img]), limiter, retries, Path(image_path).name)
     
+    if cacheable:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(cache_file, response.text)
     return response.text
 
+
+def process_quiz_batch(image_paths, model=None, limiter=None, retries=0, refresh=False,
+                       cache_dir=RESPONSE_CACHE_DIR):
+    """Send several quiz images in one request (BATCH_PROMPT) and split the answer per image.
+
+    Returns {image path: response text for that image alone}. Images whose
+    part of the answer is missing or fails quiz_problems are left out, so
+    the caller falls back to process_quiz_image for them instead of
+    re-asking about single fields. Per-image parts are cached like single
+    responses, keyed with the batch prompt.
+    """
+    if model is None:
+        model = get_model()
+    cacheable = getattr(model, 'cacheable', True)
+    responses = {}
+    todo = {}
+    for path in image_paths:
+        cache_file = cache_dir / f"{response_cache_key(path, model, BATCH_PROMPT)}.txt"
+        cached = cache_file.read_text(encoding='utf-8') if cacheable and not refresh and cache_file.exists() else None
+        # parts cached before the full quiz_problems check are asked again
+        if cached is not None and not quiz_problems(json.loads(cached)):
+            responses[path] = cached
+        else:
+            todo[f"img{len(todo) + 1}"] = (path, cache_file)
+    if not todo:
+        return responses
+
+    contents = [BATCH_PROMPT]
+    for image_id, (path, _) in todo.items():
+        contents += [f"IMAGE {image_id}", Image.open(path)]
+    label = f"batch of {len(todo)} ({Path(next(iter(todo.values()))[0]).name}, ...)"
+    response = call_with_retry(lambda: model.generate_content(contents), limiter, retries, label)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for image_id, quiz_data in split_batch_response(response.text, todo).items():
+        path, cache_file = todo[image_id]
+        responses[path] = json.dumps(quiz_data, indent=2, ensure_ascii=False)
+        if cacheable:
+            write_text_atomic(cache_file, responses[path])
+    return responses
+
+def repair_latex_escapes(text):
+    """Double the backslashes of LaTeX commands inside the JSON strings of text.
+
+    Models often write "\frac" instead of "\\frac" in JSON. Some of those
+    are invalid escapes and break parsing, others are valid ones that
+    silently turn into control characters (\f, \b, \t, \r, \n). A backslash
+    followed by a letter run is taken as a JSON escape only when it is a
+    single escape letter, or \n starting a capitalized word or a word that
+    is not a LaTeX command. Doubly escaped unicode escapes are undoubled.
+    """
+    def escape_repl(m):
+        token = m.group(1)
+        if len(token) == 5 and token[0] == 'u' and all(c in HEX_DIGITS for c in token[1:]):
+            return m.group(0)
+        if token in ('"', '\\', '/'):
+            return m.group(0)
+        if token.isalpha():
+            if len(token) == 1 and token in 'bfnrt':
+                return m.group(0)
+            if token[0] in 'bfnrt' and token[1].isupper():
+                return m.group(0)
+            if token[0] == 'n' and token not in LATEX_N_COMMANDS and not token.startswith('not'):
+                return m.group(0)
+        return '\\' + m.group(0)
+
+    def string_repl(m):
+        return JSON_ESCAPE_PATTERN.sub(escape_repl, DOUBLE_UNICODE_ESCAPE_PATTERN.sub(r'\\\1', m.group(0)))
+
+    return JSON_STRING_PATTERN.sub(string_repl, text)
+
+
 def extract_json_from_response(response_text):
-    """Extract and parse JSON from AI response."""
+    """Extract and parse JSON from AI response (LaTeX backslashes are repaired first)."""
     # Remove markdown code blocks if present
     text = response_text.strip()
     if text.startswith("```json"):
@@ -100,60 +354,242 @@ def extract_json_from_response(response_text):
     
     text = text.strip()
     
-    # Try to parse, if it fails due to escape sequences, try to fix them
+    repaired = repair_latex_escapes(text)
+    if repaired != text:
+        record_metric('escape_repaired', True)
     try:
-        return json.loads(text)
+        return json.loads(repaired)
     except json.JSONDecodeError as e:
         print(f"  JSON decode error: {e}")
-        print(f"  Attempting to fix escape sequences...")
-        # Replace single backslashes with double backslashes for LaTeX
-        # But be careful not to double-escape already escaped sequences
-        import re
-        # This regex finds backslashes that aren't already escaped
-        text = re.sub(r'(?<!\\)\\(?!["\\/bfnrtu])', r'\\\\', text)
+        print(f"  Response text sample: {text[:500]}...")
+        raise
+
+
+def quiz_problems(quiz_data):
+    """Check one image's quiz data against the expected schema.
+
+    The data must hold exactly one question with text and EXPECTED_ANSWERS
+    answers, each with text and a boolean "correct". Obvious type slips
+    ("true", 1) are fixed in place. Returns {field path: problem} for what
+    is still wrong, e.g. {'questions[0].answers[2].correct': 'not a boolean'}.
+    """
+    if not isinstance(quiz_data, dict) or not isinstance(quiz_data.get("questions"), list):
+        return {'questions': 'missing list of questions'}
+    questions = quiz_data["questions"]
+    if len(questions) != 1 or not isinstance(questions[0], dict):
+        return {'questions': f'expected exactly 1 question object, got {len(questions)}'}
+    question = questions[0]
+    problems = {}
+    if not isinstance(question.get("question"), str) or not question["question"].strip():
+        problems['questions[0].question'] = 'missing question text'
+    answers = question.get("answers")
+    if not isinstance(answers, list) or len(answers) != EXPECTED_ANSWERS:
+        count = len(answers) if isinstance(answers, list) else 0
+        problems['questions[0].answers'] = f'expected {EXPECTED_ANSWERS} answers, got {count}'
+        return problems
+    for i, ans in enumerate(answers):
+        path = f'questions[0].answers[{i}]'
+        if not isinstance(ans, dict):
+            problems[path] = 'not an answer object'
+            continue
+        if not isinstance(ans.get("text"), str) or not ans["text"].strip():
+            problems[f'{path}.text'] = 'missing answer text'
+        correct = ans.get("correct")
+        if isinstance(correct, str) and correct.strip().lower() in ('true', 'false'):
+            ans["correct"] = correct.strip().lower() == 'true'
+        elif isinstance(correct, int) and not isinstance(correct, bool) and correct in (0, 1):
+            ans["correct"] = bool(correct)
+        elif not isinstance(correct, bool):
+            problems[f'{path}.correct'] = 'not a boolean'
+    return problems
+
+
+def get_field(data, path):
+    """Get a field of nested dicts/lists by a path like 'questions[0].answers[2].correct'."""
+    for key in FIELD_PATH_PATTERN.findall(path):
+        data = data[int(key) if key.isdigit() else key]
+    return data
+
+
+def set_field(data, path, value):
+    """Set a field of nested dicts/lists by a path like 'questions[0].answers[2].correct'."""
+    keys = [int(k) if k.isdigit() else k for k in FIELD_PATH_PATTERN.findall(path)]
+    target = data
+    for key in keys[:-1]:
+        target = target[key]
+    target[keys[-1]] = value
+
+
+def extract_quiz_data(response_text, image_path, model, limiter=None, retries=0):
+    """Parse and validate a response, asking the model small follow-up questions for what is wrong.
+
+    Unparseable JSON is sent back as text only, for a syntax fix. Fields that
+    fail quiz_problems are re-asked with the screenshot, listing only those
+    fields, for up to FOLLOWUP_ROUNDS rounds. Raises ValueError if the data
+    is still invalid after that.
+    """
+    try:
+        quiz_data = extract_json_from_response(response_text)
+    except json.JSONDecodeError as e:
+        print(f"  {Path(image_path).name}: asking the model to fix the JSON syntax")
+        record_metric('syntax_fix', True)
+        prompt = SYNTAX_FIX_PROMPT.format(error=e, text=response_text)
+        fixed = call_with_retry(lambda: model.generate_content([prompt]), limiter, retries, Path(image_path).name)
+        quiz_data = extract_json_from_response(fixed.text)
+
+    for _ in range(FOLLOWUP_ROUNDS):
+        problems = quiz_problems(quiz_data)
+        if not problems:
+            return quiz_data
+        print(f"  {Path(image_path).name}: re-asking for {', '.join(problems)}")
+        record_metric('followup_fields', len(problems), add=True)
+        prompt = FIELD_FIX_PROMPT.format(
+            current=json.dumps(quiz_data, ensure_ascii=False, indent=2),
+            problems="\n".join(f"    - {path}: {problem}" for path, problem in problems.items()),
+        )
+        img = Image.open(image_path)
+        response = call_with_retry(lambda: model.generate_content([prompt, img]), limiter, retries, Path(image_path).name)
         try:
-            return json.loads(text)
-        except json.JSONDecodeError as e2:
-            print(f"  Still failed after fix: {e2}")
-            print(f"  Response text sample: {text[:500]}...")
-            raise
+            fixes = extract_json_from_response(response.text)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(fixes, dict):
+            continue
+        if 'questions' in problems:
+            if isinstance(fixes.get('questions'), list):
+                quiz_data = {'questions': fixes['questions']}
+            continue
+        for path, value in fixes.items():
+            if path in problems:
+                try:
+                    set_field(quiz_data, path, value)
+                except (KeyError, IndexError, TypeError):
+                    pass
 
-def main():
-    # Define paths
-    quiz_folder = Path("./quiz")
-    output_base = Path("./questions")
-    output_base.mkdir(exist_ok=True)
-    
-    # Get all image files
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
-    image_files = [f for f in quiz_folder.iterdir() 
-                   if f.suffix.lower() in image_extensions]
-    
-    print(f"Found {len(image_files)} images to process")
-    
-    # Process each image
-    for idx, image_path in enumerate(image_files, 1):
-        print(f"\nProcessing {idx}/{len(image_files)}: {image_path.name}")
-        
+    problems = quiz_problems(quiz_data)
+    if problems:
+        raise ValueError("invalid quiz data: " + "; ".join(f"{path}: {problem}" for path, problem in problems.items()))
+    return quiz_data
+
+
+def split_batch_response(response_text, image_ids):
+    """Split a BATCH_PROMPT answer into {image id: quiz data} for the ids whose part passes quiz_problems."""
+    data = extract_json_from_response(response_text)
+    images = data.get("images") if isinstance(data, dict) else None
+    if not isinstance(images, dict):
+        return {}
+    return {image_id: images[image_id] for image_id in image_ids if not quiz_problems(images.get(image_id))}
+
+
+class Journal:
+    """Append-only JSONL log of each image's progress, so an interrupted batch can resume.
+
+    Every line is {"image", "hash", "state", "time"} with state one of
+    JOB_STATES, or "failed" with the last completed state in "after" and the
+    error. Jobs are keyed by image name and checked against the image hash,
+    so a different screenshot under the same name starts from scratch.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}
         try:
-            # Create output folder for this image
-            folder_name = image_path.stem  # filename without extension
-            output_folder = output_base / folder_name
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # last line of a run that was killed mid-write
+                        continue
+                    self.jobs[entry['image']] = entry
+        except FileNotFoundError:
+            pass
+        # keep only the latest entry per image
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for entry in self.jobs.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, path)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def resume_state(self, image, digest):
+        """Last completed state of an image's job, or None if it has to start over.
+
+        A finished ('cleaned') job removed its image, so an image that is
+        back in the quiz folder starts a new job (still served from the
+        response cache unless refresh is asked for).
+        """
+        entry = self.jobs.get(image)
+        if not entry or entry['hash'] != digest or entry['state'] == 'cleaned':
+            return None
+        return entry.get('after') if entry['state'] == 'failed' else entry['state']
+
+    def record(self, image, digest, state, **extra):
+        entry = {'image': image, 'hash': digest, 'state': state, 'time': round(time.time(), 3), **extra}
+        with self.lock:
+            self.jobs[image] = entry
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def process_image_file(image_path, output_base, model, limiter=None, retries=5, refresh=False, journal=None,
+                       response_text=None, preprocess=None):
+    """Convert one quiz image into questions/<stem>/ (image copy, raw_response.txt, quiz_data.json).
+
+    response_text is this image's answer when it was already obtained in a
+    batch; otherwise the model is asked for this image alone, pre-processed
+    with `preprocess` (see screenshots.py) if given. With a journal, each
+    step is recorded as it completes and a job from an interrupted run
+    continues after its last completed step.
+    """
+    digest = file_digest(image_path)
+    resume = journal.resume_state(image_path.name, digest) if journal and not refresh else None
+    done = JOB_STATES.index(resume) + 1 if resume else 0
+    state = resume
+
+    def step(new_state):
+        nonlocal state
+        state = new_state
+        if journal:
+            journal.record(image_path.name, digest, new_state)
+
+    # Create output folder for this image
+    folder_name = image_path.stem  # filename without extension
+    output_folder = output_base / folder_name
+    raw_path = output_folder / "raw_response.txt"
+    json_path = output_folder / "quiz_data.json"
+    try:
+        if done == 0:
+            step('queued')
+        
+        if done <= JOB_STATES.index('uploaded') or not raw_path.exists():
             output_folder.mkdir(exist_ok=True)
+            upload_path = prepare_upload(image_path, preprocess)
+            # Copy original (or the processed, if asked to store that) image to output folder
+            if preprocess and preprocess.store_processed and upload_path != image_path:
+                shutil.copy2(upload_path, output_folder / f"{image_path.stem}.png")
+            else:
+                shutil.copy2(image_path, output_folder / image_path.name)
+            step('uploaded')
             
-            # Copy original image to output folder
-            import shutil
-            shutil.copy2(image_path, output_folder / image_path.name)
+            # Process the image (cached responses are reused; model calls are rate limited and retried)
+            if response_text is None:
+                response_text = process_quiz_image(upload_path, model, limiter, retries, refresh)
             
-            # Process the image
-            response_text = process_quiz_image(image_path)
+            record_metric('response_bytes', len(response_text.encode('utf-8')))
             
             # Save raw response for debugging
-            with open(output_folder / "raw_response.txt", 'w', encoding='utf-8') as f:
-                f.write(response_text)
-            
+            write_text_atomic(raw_path, response_text)
+            step('responded')
+        
+        if done <= JOB_STATES.index('parsed') or not json_path.exists():
             # Extract and parse JSON
-            quiz_data = extract_json_from_response(response_text)
+            quiz_data = extract_quiz_data(raw_path.read_text(encoding='utf-8'), image_path, model, limiter, retries)
+            step('parsed')
             
             # Force category override (use env var CATEGORY_OVERRIDE or fallback)
             category_override = os.environ.get("CATEGORY_OVERRIDE") or "01.02.2023 Rozstřel"
@@ -161,23 +597,283 @@ def main():
                 q["category"] = category_override
 
             # Save JSON to output folder
-            json_path = output_folder / "quiz_data.json"
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(quiz_data, f, indent=2, ensure_ascii=False)
-            
-            print(f"✓ Saved to {output_folder}")
-            print(f"  Found {len(quiz_data.get('questions', []))} questions")
-            
-            # Remove the original image from quiz folder after successful processing
-            os.remove(image_path)
-            print(f"  Removed original from quiz folder")
-            
+            write_text_atomic(json_path, json.dumps(quiz_data, indent=2, ensure_ascii=False))
+            step('written')
+        else:
+            quiz_data = json.loads(json_path.read_text(encoding='utf-8'))
+        
+        # Remove the original image from quiz folder after successful processing
+        os.remove(image_path)
+        step('cleaned')
+    except Exception as e:
+        record_metric('failed_after', state)
+        if journal:
+            journal.record(image_path.name, digest, 'failed', after=state, error=f"{type(e).__name__}: {e}")
+        raise
+    return output_folder, len(quiz_data.get('questions', [])), resume
+
+def process_image_batch(image_paths, output_base, model, limiter=None, retries=5, refresh=False, journal=None,
+                        preprocess=None):
+    """Convert a group of images, asking the model about all of them in one request.
+
+    Images that already have a saved response (per the journal) are not
+    sent again, and images whose part of the batch answer is invalid fall
+    back to a single-image request. Returns [(image path, result, error,
+    metrics)] with process_image_file's result or the exception it raised;
+    the batch request's model time and calls are shared among its images.
+    """
+    responses = {}
+    pending = []
+    for path in image_paths:
+        resume = journal.resume_state(path.name, file_digest(path)) if journal and not refresh else None
+        responded = resume and JOB_STATES.index(resume) >= JOB_STATES.index('responded')
+        if not responded or not (output_base / path.stem / "raw_response.txt").exists():
+            pending.append(path)
+    batch_metrics = {}
+    if len(pending) > 1:
+        with metrics_scope(batch_metrics):
+            try:
+                # savings are reported when process_image_file picks up the (cached) processed image
+                uploads = {preprocess_screenshot(path, preprocess)[0] if preprocess else path: path for path in pending}
+                responses = {uploads[upload]: text for upload, text in
+                             process_quiz_batch(list(uploads), model, limiter, retries, refresh).items()}
+            except Exception as e:
+                print(f"  Batch of {len(pending)} failed ({type(e).__name__}: {e}); falling back to single images")
+        if len(responses) < len(pending):
+            print(f"  {len(pending) - len(responses)} of {len(pending)} images in batch fall back to single requests")
+
+    results = []
+    for path in image_paths:
+        record = {'image': path.name, 'batch_size': 1}
+        if path in pending and batch_metrics:
+            record['batch_size'] = len(pending)
+            for name in ('model_calls', 'model_seconds', 'retries', 'wall_seconds'):
+                if name in batch_metrics:
+                    record[name] = round(batch_metrics[name] / len(pending), 4)
+        try:
+            with metrics_scope(record):
+                result = process_image_file(path, output_base, model, limiter, retries, refresh, journal,
+                                            responses.get(path), preprocess)
+            record['status'] = 'ok'
+            results.append((path, result, None, record))
         except Exception as e:
-            print(f"✗ Error processing {image_path.name}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            # Don't remove the image if there was an error
-            continue
+            record.update(status='failed', error_type=type(e).__name__, error=str(e)[:500])
+            results.append((path, None, e, record))
+    return results
+
+def find_imported_duplicates(image_paths, output_base, max_distance=DUPLICATE_DISTANCE):
+    """Match incoming screenshots against the ones already under output_base by perceptual hash.
+
+    The index of imported screenshots is kept in .cache/ (see
+    screenshots.dhash_index). Returns {image path: (matched screenshot, distance)}.
+    """
+    known = dhash_index(question_image_files(scan_questions_dir(output_base)))
+    # a folder left by an interrupted run of the same image is not a duplicate
+    stems = {path.stem for path in image_paths}
+    known = {key: h for key, h in known.items() if key.split('/')[0] not in stems}
+    with ThreadPoolExecutor() as pool:
+        candidates = dict(zip(image_paths, pool.map(dhash, image_paths)))
+    return find_near_duplicates(candidates, known, max_distance)
+
+def reparse_quiz_data(raw_text, current):
+    """Re-extract one folder's quiz data from its raw response, keeping what was curated in `current`.
+
+    All top-level fields but "questions" (the id from rename.py, the manual
+    list) are kept, questions keep their category, and the field paths
+    listed under MANUAL_KEY keep their current value. Raises ValueError if
+    the response does not give valid data without asking the model.
+    """
+    quiz_data = extract_json_from_response(raw_text)
+    problems = quiz_problems(quiz_data)
+    if problems:
+        raise ValueError("invalid quiz data: " + "; ".join(f"{path}: {problem}" for path, problem in problems.items()))
+    old_questions = current.get("questions") or [{}]
+    for i, q in enumerate(quiz_data["questions"]):
+        old = old_questions[min(i, len(old_questions) - 1)]
+        if isinstance(old, dict) and "category" in old:
+            q["category"] = old["category"]
+    for path in current.get(MANUAL_KEY) or []:
+        set_field(quiz_data, path, get_field(current, path))
+    result = {key: value for key, value in current.items() if key != "questions"}
+    result["questions"] = quiz_data["questions"]
+    # keep the usual key order (questions first)
+    return {"questions": result.pop("questions"), **result}
+
+
+def reparse_folder(folder: Path):
+    """Return (folder, current quiz_data.json text, re-extracted text or None, error) for one question folder."""
+    json_path = folder / "quiz_data.json"
+    current_text = json_path.read_text(encoding='utf-8') if json_path.exists() else ""
+    try:
+        current = json.loads(current_text) if current_text else {}
+        if current.get(MANUAL_KEY) is True:
+            return folder, current_text, None, None
+        raw_text = (folder / "raw_response.txt").read_text(encoding='utf-8')
+        quiz_data = reparse_quiz_data(raw_text, current)
+    except Exception as e:
+        return folder, current_text, None, f"{type(e).__name__}: {e}"
+    return folder, current_text, json.dumps(quiz_data, indent=2, ensure_ascii=False), None
+
+
+def reparse_all(output_base: Path, workers=None, write=False):
+    """Re-extract every quiz_data.json under output_base from its saved raw_response.txt.
+
+    Folders are re-extracted in parallel processes without any model call
+    and changed files are shown as a diff. They are only written (atomically)
+    with write=True, since a re-extraction also undoes hand corrections that
+    are not listed under MANUAL_KEY; folders whose response no longer parses
+    keep their file.
+    """
+    folders = sorted(f for f in output_base.iterdir() if f.is_dir() and (f / "raw_response.txt").exists())
+    start = time.monotonic()
+    changed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for folder, old_text, new_text, error in pool.map(reparse_folder, folders, chunksize=16):
+            if error:
+                failed += 1
+                print(f"✗ {folder.name}: {error} (kept as is)")
+                continue
+            if new_text is None or new_text.rstrip() == old_text.rstrip():
+                continue
+            changed += 1
+            json_path = folder / "quiz_data.json"
+            print("\n".join(difflib.unified_diff(
+                old_text.splitlines(), new_text.splitlines(), f"a/{json_path}", f"b/{json_path}", lineterm="",
+            )))
+            if write:
+                write_text_atomic(json_path, new_text)
+    verb = "changed" if write else "would change"
+    print(f"Reparsed {len(folders)} folders in {time.monotonic() - start:.1f}s: {changed} {verb}, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert quiz screenshots in ./quiz into questions/<name>/quiz_data.json.")
+    parser.add_argument('--quiz-dir', type=Path, default=Path("./quiz"), help="folder with the screenshots to convert")
+    parser.add_argument('--output-dir', type=Path, default=Path("./questions"), help="where the question folders are written")
+    parser.add_argument('--workers', type=int, default=4, help="maximum number of model requests in flight")
+    parser.add_argument('--rate', type=float, default=1.0, help="maximum model requests per second")
+    parser.add_argument('--burst', type=int, default=4, help="requests allowed at once before --rate applies")
+    parser.add_argument('--retries', type=int, default=5, help="retries per image on rate limits, timeouts and server errors")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="screenshots sent together in one model request (1 = one request per image)")
+    parser.add_argument('--max-dim', type=int, default=PreprocessOptions().max_dim,
+                        help="downsample screenshots to at most this many pixels per side before upload")
+    parser.add_argument('--grayscale', action='store_true', help="convert screenshots to grayscale before upload")
+    parser.add_argument('--no-preprocess', action='store_true',
+                        help="upload the original screenshots (no cropping or downsampling)")
+    parser.add_argument('--store-processed', action='store_true',
+                        help="keep the processed screenshot in the question folder instead of the original")
+    parser.add_argument('--duplicates', choices=('skip', 'report', 'off'), default='skip',
+                        help="what to do with screenshots that look like already imported ones (default: skip)")
+    parser.add_argument('--duplicate-distance', type=int, default=DUPLICATE_DISTANCE,
+                        help="maximum perceptual hash distance (bits) for a near-duplicate")
+    parser.add_argument('--metrics', type=Path,
+                        help=f"per-image metrics JSONL for this run (default: {METRICS_DIR}/<time>.jsonl)")
+    parser.add_argument('--reparse', action='store_true',
+                        help="diff every quiz_data.json in --output-dir against its raw_response.txt (no model calls)")
+    parser.add_argument('--write', action='store_true',
+                        help="with --reparse, write the changed files (default: only show the diff)")
+    parser.add_argument('--report', type=Path, metavar='METRICS_FILE',
+                        help="print the report of an earlier run's metrics file and exit")
+    parser.add_argument('--journal', type=Path, default=JOURNAL_FILE,
+                        help="JSONL job journal used to resume interrupted runs")
+    parser.add_argument('--refresh', action='store_true',
+                        help="ignore cached model responses and ask the model again")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='gemini',
+                        help="model backend: gemini, replay (recorded raw_response.txt files) or stub (fixed answer)")
+    parser.add_argument('--replay-dir', type=Path, default=Path("./questions"),
+                        help="question folders whose raw_response.txt the replay backend serves")
+    parser.add_argument('--latency', type=float, default=1.0, help="synthetic latency per call for replay/stub, in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="random +/- variation of --latency")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="fraction of replay/stub calls that fail with a transient error")
+    args = parser.parse_args()
+
+    if args.report:
+        print(format_report(load_metrics(args.report)))
+        return
+    if args.reparse:
+        reparse_all(args.output_dir, write=args.write)
+        return
+
+    # Define paths
+    quiz_folder = args.quiz_dir
+    output_base = args.output_dir
+    output_base.mkdir(exist_ok=True)
+    
+    # Get all image files
+    image_files = sorted(f for f in quiz_folder.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS)
+    
+    # Check all incoming screenshots against the imported ones before any model call
+    skipped = {}
+    if args.duplicates != 'off' and image_files:
+        duplicates = find_imported_duplicates(image_files, output_base, args.duplicate_distance)
+        for image_path, (match, distance) in duplicates.items():
+            match_name = match.name if isinstance(match, Path) else match
+            print(f"≈ {image_path.name} looks like {match_name} (distance {distance})")
+        if args.duplicates == 'skip' and duplicates:
+            skipped = duplicates
+            image_files = [f for f in image_files if f not in duplicates]
+            print(f"Skipping {len(duplicates)} near-duplicate screenshots (left in {quiz_folder}; use --duplicates off to import)")
+    
+    batch_size = max(1, args.batch_size)
+    batches = [image_files[i:i + batch_size] for i in range(0, len(image_files), batch_size)]
+    print(f"Found {len(image_files)} images to process in {len(batches)} requests "
+          f"({args.workers} at a time, {args.rate:g} requests/s)")
+    preprocess = None if args.no_preprocess else PreprocessOptions(args.max_dim, args.grayscale, args.store_processed)
+    if args.backend == 'gemini':
+        model = get_model()
+    elif args.backend == 'replay':
+        model = BACKENDS['replay'](args.replay_dir, preprocess, args.latency, args.latency_jitter, args.failure_rate)
+    else:
+        model = BACKENDS['stub'](args.latency, args.latency_jitter, args.failure_rate)
+    limiter = RateLimiter(args.rate, args.burst)
+    journal = Journal(args.journal)
+    metrics_log = MetricsLog(args.metrics or METRICS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    records = [{'image': path.name, 'status': 'skipped', 'duplicate_of': match.name if isinstance(match, Path) else match}
+               for path, (match, _) in skipped.items()]
+    for record in records:
+        metrics_log.write(record)
+    
+    # Process the images on a bounded pool; each image's outputs are independent
+    start = time.monotonic()
+    done = failed = 0
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        futures = [
+            pool.submit(process_image_batch, batch, output_base, model, limiter, args.retries, args.refresh, journal,
+                        preprocess)
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            for image_path, result, error, record in future.result():
+                records.append(record)
+                metrics_log.write(record)
+                if error is not None:
+                    # Don't remove the image if there was an error
+                    failed += 1
+                    print(f"✗ Error processing {image_path.name}: {str(error)}")
+                    traceback.print_exception(error)
+                    continue
+                output_folder, count, resumed = result
+                done += 1
+                note = f", resumed after '{resumed}'" if resumed else ""
+                print(f"✓ [{done + failed}/{len(image_files)}] {image_path.name} -> {output_folder} ({count} questions{note})")
+    except KeyboardInterrupt:
+        # let the running jobs finish their current step; the rest resume on the next run
+        print("\nInterrupted; waiting for running jobs (progress is kept in the journal)...")
+        pool.shutdown(cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown()
+        journal.close()
+        metrics_log.close()
+    
+    elapsed = time.monotonic() - start
+    rate = done / elapsed if elapsed else 0.0
+    print(f"\nConverted {done} of {len(image_files)} images in {elapsed:.1f}s ({rate:.2f} images/s, {failed} failed)")
+    print(format_report(records, elapsed))
+    print(f"Per-image metrics: {metrics_log.path}")
 
 if __name__ == "__main__":
     main()
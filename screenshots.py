@@ -0,0 +1,143 @@
+"""Screenshot pre-processing before model upload (crop to content, downsample, optional grayscale)
+and perceptual hashes for spotting screenshots of questions that were already imported."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image, ImageChops
+
+from assets import file_digest, load_manifest, save_manifest
+
+# bump when the processing changes, so cached outputs get regenerated
+PREPROCESS_VERSION = 1
+PREPROCESS_CACHE_DIR = Path("./.cache") / "preprocessed"
+# pixels closer than this to the border colour count as background
+CROP_THRESHOLD = 24
+# background kept around the content after cropping
+CROP_MARGIN = 8
+
+
+class PreprocessOptions(NamedTuple):
+    max_dim: int = 1600
+    grayscale: bool = False
+    # store the processed image in the question folder instead of the original
+    store_processed: bool = False
+
+    def tag(self):
+        return f"v{PREPROCESS_VERSION}-{self.max_dim}{'-gray' if self.grayscale else ''}"
+
+
+def content_bbox(im):
+    """Bounding box of everything that differs from the border colour (taken from the top-left pixel)."""
+    gray = im.convert('L')
+    background = Image.new('L', gray.size, gray.getpixel((0, 0)))
+    mask = ImageChops.difference(gray, background).point(lambda v: 255 if v > CROP_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    return (max(0, left - CROP_MARGIN), max(0, top - CROP_MARGIN),
+            min(im.width, right + CROP_MARGIN), min(im.height, bottom + CROP_MARGIN))
+
+
+def preprocess_screenshot(image_path: Path, options: PreprocessOptions, cache_dir: Path = PREPROCESS_CACHE_DIR):
+    """Return (processed PNG path, original bytes, processed bytes) for a screenshot.
+
+    Outputs are cached by the source's content hash and the options, so each
+    screenshot is only processed once. When processing does not make the
+    file smaller, the original is used as is.
+    """
+    original_size = os.path.getsize(image_path)
+    out = cache_dir / f"{file_digest(image_path)}-{options.tag()}.png"
+    if not out.exists():
+        with Image.open(image_path) as im:
+            im.load()
+            if im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            bbox = content_bbox(im)
+            if bbox:
+                im = im.crop(bbox)
+            im.thumbnail((options.max_dim, options.max_dim), Image.LANCZOS)
+            if options.grayscale:
+                im = im.convert('L')
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = out.with_name(out.name + '.tmp')
+            im.save(tmp_file, format='PNG', optimize=True)
+            os.replace(tmp_file, out)
+    processed_size = os.path.getsize(out)
+    if processed_size >= original_size:
+        return Path(image_path), original_size, original_size
+    return out, original_size, processed_size
+
+
+# dHash over a DHASH_SIZE x DHASH_SIZE grid of the cropped screenshot (256 bits);
+# on this corpus re-imports of one question differ in at most ~30 bits
+DHASH_SIZE = 16
+DUPLICATE_DISTANCE = 30
+DHASH_INDEX_FILE = Path("./.cache") / f"dhash-index-v{PREPROCESS_VERSION}.json"
+
+
+def dhash(image_path: Path) -> str:
+    """Difference hash of a screenshot's content, as a hex string."""
+    with Image.open(image_path) as im:
+        gray = im.convert('L')
+    bbox = content_bbox(gray)
+    if bbox:
+        gray = gray.crop(bbox)
+    pixels = gray.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            i = row * (DHASH_SIZE + 1) + col
+            value = value << 1 | (pixels[i] > pixels[i + 1])
+    return f"{value:0{DHASH_SIZE * DHASH_SIZE // 4}x}"
+
+
+def hash_distance(a: str, b: str) -> int:
+    """Number of differing bits between two hashes from dhash."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def dhash_index(images, index_file: Path = DHASH_INDEX_FILE, workers=None):
+    """Return {key: dhash} for `images` ({key: path}, see corpus.image_files).
+
+    Hashes are kept in index_file and reused while a file's size and mtime
+    are unchanged, so only new or modified screenshots are decoded.
+    """
+    old_index = load_manifest(index_file)
+    index = {}
+    todo = []
+    for key, path in images.items():
+        st = os.stat(path)
+        entry = old_index.get(key)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            index[key] = entry
+        else:
+            todo.append((key, path, st))
+    # Pillow releases the GIL while decoding and resizing
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (key, _, st), h in zip(todo, pool.map(lambda job: dhash(job[1]), todo)):
+            index[key] = [st.st_size, st.st_mtime_ns, h]
+    if index != old_index:
+        save_manifest(index_file, index)
+    return {key: entry[2] for key, entry in index.items()}
+
+
+def find_near_duplicates(candidates, known, max_distance=DUPLICATE_DISTANCE):
+    """Match screenshots against already known ones.
+
+    `candidates` and `known` map keys to hashes from dhash. Candidates are
+    also compared with each other, in order, so the second copy of a new
+    screenshot is matched to the first. Returns {candidate key: (closest
+    key, distance)} for those within max_distance bits.
+    """
+    pool = dict(known)
+    matches = {}
+    for key, h in candidates.items():
+        best = min(((hash_distance(h, other), other_key) for other_key, other in pool.items()), default=None)
+        if best is not None and best[0] <= max_distance:
+            matches[key] = (best[1], best[0])
+        else:
+            pool[key] = h
+    return matches
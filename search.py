@@ -0,0 +1,171 @@
+"""Build-time full-text search index over question and answer text, and the page code that queries it.
+
+The index is built from the TeX sources (before pre-rendering to MathML)
+with a LaTeX-aware tokenizer: outside math, words and numbers are tokens;
+inside math, command names (\\cos -> "cos"), single-letter identifiers and
+numbers are. Czech diacritics are folded and everything is lowercased, so
+"Taylorův" is found by "tayloruv". The page tokenizes queries the same way
+(SEARCH_JS) and intersects posting lists, so a lookup never scans the
+questions.
+
+    {"v": 1,                   format version
+     "k": [...],               sorted tokens
+     "p": [[...], ...],        posting list of each token: delta-encoded document numbers
+     "d": [[quiz_id, category, snippet], ...]}
+                               documents (questions); category indexes the page's category list
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from pathlib import Path
+
+from assets import hashed_name
+from mathrender import SEGMENT_PATTERN
+
+SEARCH_INDEX_VERSION = 1
+# \command, a letter run, or a digit run (after folding)
+TOKEN_PATTERN = re.compile(r'\\([A-Za-z]+)|([^\W\d_]+)|(\d+)')
+SNIPPET_LENGTH = 100
+
+
+def fold(text: str) -> str:
+    """Lowercase text and strip diacritics ("Řešení" -> "reseni")."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _tokens(text: str, math: bool):
+    for m in TOKEN_PATTERN.finditer(text):
+        command, letters, number = m.groups()
+        if command:
+            yield command
+        elif letters:
+            # in math every letter is its own identifier: "xy" is x times y
+            yield from (letters if math else (letters,))
+        else:
+            yield number
+
+
+def tokenize(text: str):
+    """Yield the search tokens of a text with $...$, $$...$$, \\(...\\) or \\[...\\] math."""
+    if not text:
+        return
+    text = fold(text)
+    pos = 0
+    for m in SEGMENT_PATTERN.finditer(text):
+        yield from _tokens(text[pos:m.start()], math=False)
+        yield from _tokens(next(g for g in m.groups() if g is not None), math=True)
+        pos = m.end()
+    yield from _tokens(text[pos:], math=False)
+
+
+def snippet(text: str) -> str:
+    """Short plain preview of a question for the result list."""
+    text = ' '.join(SEGMENT_PATTERN.sub(lambda m: next(g for g in m.groups() if g is not None), text or '').split())
+    return text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH - 1] + '…'
+
+
+def build_search_index(questions, categories):
+    """Return the search index payload for question records with TeX sources.
+
+    `categories` is the page's category list, in shard order.
+    """
+    category_index = {name: i for i, name in enumerate(categories)}
+    postings = {}
+    documents = []
+    for n, q in enumerate(questions):
+        texts = [q.get('question', '')] + [ans.get('text', '') for ans in q.get('answers', [])]
+        for token in {token for text in texts for token in tokenize(text)}:
+            postings.setdefault(token, []).append(n)
+        documents.append([q['quiz_id'], category_index[q.get('category', 'Matematika')], snippet(q.get('question'))])
+    keys = sorted(postings)
+    deltas = [[b - a for a, b in zip([0] + postings[k], postings[k])] for k in keys]
+    return {'v': SEARCH_INDEX_VERSION, 'k': keys, 'p': deltas, 'd': documents}
+
+
+def write_search_index(questions, categories, assets_folder: Path):
+    """Write the index to assets/search-<hash>.json, remove older ones and return its URL."""
+    raw = json.dumps(build_search_index(questions, categories), ensure_ascii=False,
+                     separators=(',', ':')).encode('utf-8')
+    name = 'search-' + hashed_name(hashlib.sha256(raw).hexdigest(), '.json')
+    path = assets_folder / name
+    if not path.exists():
+        assets_folder.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix('.tmp')
+        tmp_file.write_bytes(raw)
+        os.replace(tmp_file, path)
+    for old in assets_folder.glob('search-*'):
+        if not old.name.startswith(name):
+            old.unlink()
+    return f"assets/{name}"
+
+
+# Query side of the index for the generated page: tokenize() and fold() in JS,
+# then an AND of exact token matches, the last token also matching as a prefix.
+SEARCH_JS = r"""
+        const SEARCH_SEGMENT = /\$\$([\s\S]+?)\$\$|\\\[([\s\S]+?)\\\]|\$([\s\S]+?)\$|\\\(([\s\S]+?)\\\)/g;
+        const SEARCH_TOKEN = /\\([A-Za-z]+)|(\p{L}+)|(\d+)/gu;
+
+        function searchTokens(text, math, out) {
+            for (const m of text.matchAll(SEARCH_TOKEN)) {
+                if (m[1]) out.push(m[1]);
+                else if (m[2] && math) out.push(...m[2]);
+                else out.push(m[2] || m[3]);
+            }
+        }
+
+        function tokenizeQuery(text) {
+            text = text.normalize('NFKD').replace(/\p{M}/gu, '').toLowerCase();
+            const out = [];
+            let pos = 0;
+            for (const m of text.matchAll(SEARCH_SEGMENT)) {
+                searchTokens(text.slice(pos, m.index), false, out);
+                searchTokens(m[1] || m[2] || m[3] || m[4], true, out);
+                pos = m.index + m[0].length;
+            }
+            searchTokens(text.slice(pos), false, out);
+            return out;
+        }
+
+        function lowerBound(keys, token) {
+            let lo = 0, hi = keys.length;
+            while (lo < hi) {
+                const mid = (lo + hi) >> 1;
+                if (keys[mid] < token) lo = mid + 1; else hi = mid;
+            }
+            return lo;
+        }
+
+        function postingList(index, i) {
+            if (!index.lists[i]) {
+                let n = 0;
+                index.lists[i] = index.p[i].map(d => n += d);
+            }
+            return index.lists[i];
+        }
+
+        function searchIndex(index, query, limit) {
+            const tokens = [...new Set(tokenizeQuery(query))];
+            if (tokens.length === 0) return [];
+            const prefix = /[\p{L}\d]$/u.test(query) ? tokens[tokens.length - 1] : null;
+            let result = null;
+            for (const token of tokens) {
+                let docs;
+                const i = lowerBound(index.k, token);
+                if (token === prefix) {
+                    const hits = new Set();
+                    for (let j = i; j < index.k.length && index.k[j].startsWith(token); j++) {
+                        postingList(index, j).forEach(n => hits.add(n));
+                    }
+                    docs = hits;
+                } else {
+                    docs = new Set(index.k[i] === token ? postingList(index, i) : []);
+                }
+                result = result === null ? docs : new Set([...result].filter(n => docs.has(n)));
+                if (result.size === 0) break;
+            }
+            return [...result].sort((a, b) => a - b).slice(0, limit).map(n => index.d[n]);
+        }
+"""